@@ -8,6 +8,9 @@ from .models import (
     Curriculum,
     Lesson,
     Payment,
+    IPNMessage,
+    PaymentEvent,
+    RevenueRollup,
     ContactMessage,
 )
 
@@ -24,6 +27,42 @@ admin.site.register(ContactMessage)
 # Register your models here.
 class StudentAdmin(admin.ModelAdmin):
     filter_horizontal = ("courses_enlisted",)
+    list_display = ("user", "paid", "subscription_end", "subscription_state")
+    list_filter = ("paid",)
+    list_select_related = ("user",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_subscription_state()
+
+    @admin.display(ordering="subscription_state")
+    def subscription_state(self, obj):
+        return obj.subscription_state
 
 
 admin.site.register(Student, StudentAdmin)
+
+
+class IPNMessageAdmin(admin.ModelAdmin):
+    list_display = ("payment_id", "payment_status", "received_at", "processed_at", "attempts")
+    list_filter = ("payment_status",)
+    search_fields = ("payment_id",)
+
+
+admin.site.register(IPNMessage, IPNMessageAdmin)
+
+
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ("payment_id", "payment_status", "applied", "received_at")
+    search_fields = ("payment_id",)
+
+
+admin.site.register(PaymentEvent, PaymentEventAdmin)
+
+
+class RevenueRollupAdmin(admin.ModelAdmin):
+    list_display = ("day", "currency", "subscription_type", "payments", "revenue", "refunds", "refunded")
+    list_filter = ("currency", "subscription_type")
+    date_hierarchy = "day"
+
+
+admin.site.register(RevenueRollup, RevenueRollupAdmin)
@@ -1,9 +1,14 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
 from django.conf import settings
+from django.utils.translation import gettext_lazy as _
 
 from rest_framework.authentication import CSRFCheck
 from rest_framework import exceptions
 
+from .usercache import build_user, get_user_snapshot
+
 def enforce_csrf(request):
     """
     Enforce CSRF validation.
@@ -14,7 +19,36 @@ def enforce_csrf(request):
     if reason:
         raise exceptions.PermissionDenied('CSRF Failed: %s' % reason)
 
-class CustomAuthentication(JWTAuthentication):
+class CachedUserJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the token's user through api.usercache
+    instead of querying the database on every request.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        snapshot = get_user_snapshot(user_id)
+        if snapshot is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        user = build_user(snapshot)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != snapshot["revoke_claim"]:
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
+
+class CustomAuthentication(CachedUserJWTAuthentication):
     """Custom authentication class"""
     def authenticate(self, request):
         header = self.get_header(request)
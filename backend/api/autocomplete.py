@@ -0,0 +1,138 @@
+"""
+Title autocomplete served from an in-process prefix index.
+
+Every course and curriculum title is normalized and stored in a sorted list
+once per word start ("web security" is found by "web" and by "sec"), so a
+lookup is a bisect plus a forward scan over the matching keys. The index is
+rebuilt lazily the first time it is used after the catalog version (see
+api.cache) moves. Without a shared cache that version only follows this
+process's own writes, so the index is also rebuilt once it is older than
+AUTOCOMPLETE_INDEX_MAX_AGE seconds.
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .cache import catalog_version, shared_cache_configured
+from .models import Course, Curriculum
+
+NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+MAX_LIMIT = 20
+
+
+def normalize(text):
+    """Casefold, strip accents and collapse punctuation/whitespace."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return NON_WORD_RE.sub(" ", text.casefold()).strip()
+
+
+class PrefixIndex:
+    def __init__(self, entries):
+        """
+        ``entries`` are ``(kind, id, course_id, title)`` tuples. Keys are
+        kept in a plain sorted list with the entry position alongside, and
+        the title starts again in a list of their own.
+        """
+        self.entries = list(entries)
+        keys = []
+        for position, (_, _, _, title) in enumerate(self.entries):
+            normalized = normalize(title)
+            words = normalized.split(" ")
+            offset = 0
+            for word_number, word in enumerate(words):
+                if word:
+                    # Word number first ranks title-start matches highest
+                    keys.append((normalized[offset:], word_number, position))
+                offset += len(word) + 1
+        keys.sort()
+        self.keys = keys
+        self.title_keys = [key for key in keys if key[1] == 0]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        # Title-start matches rank above all others, the other word starts
+        # are only looked at when there are fewer than ``limit`` of them
+        ranked = self.rank(self.title_keys, prefix, limit)
+        if len(ranked) < limit:
+            ranked = self.rank(self.keys, prefix, limit)
+        return [self.entries[position] for *_, position in ranked]
+
+    def rank(self, keys, prefix, limit):
+        """The best ``limit`` entries with a key in ``keys`` starting with ``prefix``."""
+        word_numbers = {}
+        for index in range(bisect_left(keys, (prefix,)), len(keys)):
+            key, word_number, position = keys[index]
+            if not key.startswith(prefix):
+                break
+            if word_number < word_numbers.get(position, word_number + 1):
+                word_numbers[position] = word_number
+        return heapq.nsmallest(
+            limit,
+            (
+                (word_number, len(self.entries[position][3]), position)
+                for position, word_number in word_numbers.items()
+            ),
+        )
+
+
+def build_index():
+    entries = [
+        ("course", pk, pk, title)
+        for pk, title in Course.objects.values_list("pk", "title").iterator()
+    ]
+    entries += [
+        ("curriculum", pk, course_id, title)
+        for pk, course_id, title in Curriculum.objects.values_list(
+            "pk", "course_id", "title"
+        ).iterator()
+    ]
+    return PrefixIndex(entries)
+
+
+_index = None
+_index_version = None
+_index_built_at = None
+_lock = threading.Lock()
+
+
+def index_is_current(version):
+    if _index is None or _index_version != version:
+        return False
+    # Writes in other processes don't reach a per-process version
+    return shared_cache_configured() or (
+        time.monotonic() - _index_built_at <= settings.AUTOCOMPLETE_INDEX_MAX_AGE
+    )
+
+
+def get_index():
+    global _index, _index_version, _index_built_at
+    version = catalog_version()
+    if not index_is_current(version):
+        with _lock:
+            # Another thread may have rebuilt it while we waited
+            if not index_is_current(version):
+                _index = build_index()
+                _index_version = version
+                _index_built_at = time.monotonic()
+    return _index
+
+
+def autocomplete(prefix, limit=10):
+    return [
+        {"type": kind, "id": pk, "course_id": course_id, "title": title}
+        for kind, pk, course_id, title in get_index().lookup(
+            prefix, min(limit, MAX_LIMIT)
+        )
+    ]
@@ -0,0 +1,154 @@
+"""
+In-memory membership check for blacklisted refresh token JTIs.
+
+Each process keeps a Bloom filter of blacklisted JTIs, loaded from the
+database on first use and then kept current incrementally: api.signals adds
+every new blacklist row to the local filter and bumps a generation counter
+in the shared cache, and other processes pull the rows blacklisted since
+their last sync when the generation moves or the sync interval passes.
+A JTI the filter doesn't contain is definitely not blacklisted; only
+filter hits are confirmed against the database.
+
+The generation counter only reaches other processes through a shared cache
+backend, so with a per-process one (locmem, the default) the filter is
+bypassed and every check goes to the database.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from .cache import shared_cache_configured
+
+BLACKLIST_GENERATION_KEY = "token-blacklist:generation"
+
+# Syncs re-read rows blacklisted this long before the newest one seen, so
+# rows committed after a later one (out of blacklisted_at order) aren't missed
+SYNC_OVERLAP = timedelta(minutes=1)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, value):
+        # Double hashing (Kirsch-Mitzenmacher) off a single digest
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self.positions(value)
+        )
+
+
+def blacklist_generation():
+    return cache.get(BLACKLIST_GENERATION_KEY)
+
+
+def bump_blacklist_generation():
+    try:
+        cache.incr(BLACKLIST_GENERATION_KEY)
+    except ValueError:
+        cache.add(BLACKLIST_GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+class TokenBlacklist:
+    def __init__(self, capacity, error_rate, sync_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.bloom = None
+
+    def rebuild(self):
+        """
+        Reload the filter with the blacklisted JTIs that haven't expired,
+        sized for ``capacity`` or twice their number, whichever is larger.
+        """
+        generation = blacklist_generation()
+        live = BlacklistedToken.objects.filter(token__expires_at__gt=aware_utcnow())
+        bloom_capacity = max(self.capacity, 2 * live.count())
+        bloom = BloomFilter(bloom_capacity, self.error_rate)
+        rows = live.values_list("blacklisted_at", "token__jti")
+        count = 0
+        watermark = None
+        for blacklisted_at, jti in rows.iterator():
+            bloom.add(jti)
+            count += 1
+            watermark = max(watermark or blacklisted_at, blacklisted_at)
+        self.bloom, self.bloom_capacity, self.count = bloom, bloom_capacity, count
+        self.watermark = watermark
+        self.generation = generation
+        self.synced_at = time.monotonic()
+
+    def sync(self):
+        """Add the rows blacklisted by other processes since the last sync."""
+        generation = blacklist_generation()
+        rows = BlacklistedToken.objects.all()
+        if self.watermark is not None:
+            rows = rows.filter(blacklisted_at__gte=self.watermark - SYNC_OVERLAP)
+        for blacklisted_at, jti in rows.values_list(
+            "blacklisted_at", "token__jti"
+        ).iterator():
+            # The overlap re-reads rows, only count the new ones
+            if jti not in self.bloom:
+                self.bloom.add(jti)
+                self.count += 1
+            self.watermark = max(self.watermark or blacklisted_at, blacklisted_at)
+        self.generation = generation
+        self.synced_at = time.monotonic()
+
+    def ensure_current(self):
+        with self.lock:
+            if self.bloom is None or self.count > self.bloom_capacity:
+                # Past its capacity the false positive rate climbs, start over
+                self.rebuild()
+            elif (
+                self.generation != blacklist_generation()
+                or time.monotonic() - self.synced_at > self.sync_interval
+            ):
+                self.sync()
+
+    def add(self, jti):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+                self.count += 1
+
+    def is_blacklisted(self, jti):
+        if shared_cache_configured():
+            self.ensure_current()
+            if jti not in self.bloom:
+                return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+token_blacklist = TokenBlacklist(
+    settings.TOKEN_BLACKLIST_BLOOM_CAPACITY,
+    settings.TOKEN_BLACKLIST_BLOOM_ERROR_RATE,
+    settings.TOKEN_BLACKLIST_SYNC_INTERVAL,
+)
+
+
+def token_blacklisted(jti):
+    """Record a new blacklisted JTI locally and tell the other processes."""
+    token_blacklist.add(jti)
+    bump_blacklist_generation()
+    transaction.on_commit(bump_blacklist_generation)
@@ -0,0 +1,95 @@
+"""
+Response cache for the public catalog endpoints.
+
+Entries are keyed by a catalog version counter that api.signals bumps on
+every Course/Curriculum/Lesson write, so a write makes every cached entry
+unreachable at once without scanning or deleting keys; stale entries simply
+age out of the cache backend.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = "catalog:version"
+CATALOG_HITS_KEY = "catalog:hits"
+CATALOG_MISSES_KEY = "catalog:misses"
+
+
+def shared_cache_configured():
+    """
+    Whether the default cache is shared by every process, so that version
+    counters kept in it reach all of them.
+    """
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted counter never goes back to a
+        # value that older entries were stored under
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def catalog_cache_stats():
+    hits = cache.get(CATALOG_HITS_KEY, 0)
+    misses = cache.get(CATALOG_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "version": catalog_version(),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else None,
+    }
+
+
+def catalog_cache_key(request):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f"catalog:{catalog_version()}:{url}"
+
+
+class CatalogCacheMixin:
+    """
+    Caches the serialized data of list and retrieve for viewsets whose
+    output is the same for every client.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = catalog_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            _count(CATALOG_HITS_KEY)
+            return Response(data)
+
+        _count(CATALOG_MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        return response
@@ -0,0 +1,81 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count
+from django.utils.cache import get_conditional_response
+
+from .cache import catalog_version, shared_cache_configured
+
+
+class ConditionalGetMixin:
+    """
+    Weak ETag validators for list and retrieve.
+
+    With a shared cache the ETag is derived from the request and the catalog
+    version, which api.signals bumps on every course, curriculum, lesson and
+    instructor write (deletes included), so a matching If-None-Match gets a
+    304 without querying or serializing anything. With a per-process cache
+    (locmem, the default) a write handled by another process never moves
+    this one's version, so the ETag comes from a single aggregate instead:
+    the row count and newest update time (the revision_date/last_updated
+    their writers set) of the objects the response would contain, which
+    views set in ``validator_aggregates`` (or
+    ``get_validator_aggregates``). No Last-Modified is sent: no row
+    timestamp changes when a row is deleted.
+    Views whose output also depends on other state add it in
+    ``get_etag_parts``.
+    """
+
+    # Newest update times, by name, of the objects a response contains
+    validator_aggregates = {}
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_validator_aggregates(self):
+        return self.validator_aggregates
+
+    def get_etag_parts(self, request, **kwargs):
+        if shared_cache_configured():
+            return (catalog_version(),)
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in kwargs:
+            queryset = queryset.filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        stats = queryset.order_by().aggregate(
+            count=Count("pk", distinct=True), **self.get_validator_aggregates()
+        )
+        return tuple(stats[name] for name in sorted(stats))
+
+    def get_etag(self, request, parts):
+        fingerprint = ":".join(
+            str(part) for part in (request.get_full_path(), request.user.pk, *parts)
+        )
+        return 'W/"%s"' % hashlib.md5(fingerprint.encode()).hexdigest()
+
+    def conditional_response(self, handler, request, *args, etag_parts=None, **kwargs):
+        """
+        Answer with 304/412 when the request's preconditions allow it,
+        otherwise call ``handler``. ``etag_parts`` can be passed by views
+        that already have them, skipping ``get_etag_parts``.
+        """
+        if etag_parts is None:
+            try:
+                etag_parts = self.get_etag_parts(request, **kwargs)
+            except (ValueError, TypeError, ValidationError):
+                # Malformed lookup, let the handler produce the error
+                return handler(request, *args, **kwargs)
+        etag = self.get_etag(request, etag_parts)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            if not_modified.status_code == 304:
+                not_modified["ETag"] = etag
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response["ETag"] = etag
+        return response
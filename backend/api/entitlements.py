@@ -0,0 +1,199 @@
+"""
+Per-user course entitlements (enrolled course ids and subscription state),
+kept in the shared Django cache so that access checks don't go to the
+database. api.signals drops a user's entry whenever their enrollments or
+Student row change.
+
+With ``JWT_ENTITLEMENT_CLAIMS`` on, the same data is also signed into access
+tokens (see api.tokens) and read from there. Each user has a version stamp
+in the cache that is bumped along with the invalidation; a token carrying an
+older stamp is rejected so the client refreshes it.
+"""
+import base64
+import time
+from array import array
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from .models import Student
+
+
+class Entitlements(
+    namedtuple("Entitlements", "student_id paid subscription_end course_ids")
+):
+    """
+    ``subscription_end`` is a POSIX timestamp (or None) and ``course_ids``
+    a frozenset of enrolled course ids.
+    """
+
+    @property
+    def has_active_subscription(self):
+        return (
+            self.paid
+            and self.subscription_end is not None
+            and self.subscription_end > time.time()
+        )
+
+    def is_enrolled(self, course_id):
+        return course_id in self.course_ids
+
+
+# Access token claim holding the entitlements, null for non-students
+ENTITLEMENTS_CLAIM = "ent"
+
+
+def entitlements_key(user_id):
+    return f"entitlements:{user_id}"
+
+
+def entitlements_version_key(user_id):
+    return f"entitlements:version:{user_id}"
+
+
+def entitlements_version(user_id):
+    key = entitlements_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock so a lost stamp never matches an old token
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_entitlements_version(user_id):
+    try:
+        cache.incr(entitlements_version_key(user_id))
+    except ValueError:
+        cache.add(entitlements_version_key(user_id), time.time_ns(), timeout=None)
+
+
+def encode_course_ids(course_ids):
+    """
+    Pack course ids into ``"<first id>.<bitmap>"``, the bitmap being
+    unpadded base64url with bit ``n`` set for course ``first id + n``.
+    """
+    if not course_ids:
+        return ""
+    first = min(course_ids)
+    bitmap = bytearray((max(course_ids) - first) // 8 + 1)
+    for course_id in course_ids:
+        offset = course_id - first
+        bitmap[offset // 8] |= 1 << (offset % 8)
+    encoded = base64.urlsafe_b64encode(bytes(bitmap)).rstrip(b"=").decode()
+    return f"{first}.{encoded}"
+
+
+def decode_course_ids(encoded):
+    if not encoded:
+        return frozenset()
+    first, bitmap = encoded.split(".", 1)
+    first = int(first)
+    bitmap = base64.urlsafe_b64decode(bitmap + "=" * (-len(bitmap) % 4))
+    return frozenset(
+        first + index * 8 + bit
+        for index, byte in enumerate(bitmap)
+        if byte
+        for bit in range(8)
+        if byte & (1 << bit)
+    )
+
+
+def load_entitlements(user_id):
+    """Read a user's entitlements from the database in the cached form."""
+    student = (
+        Student.objects.filter(user_id=user_id)
+        .values_list("pk", "paid", "subscription_end")
+        .first()
+    )
+    if student is None:
+        # Not a student, cached too so the answer stays a cache hit
+        return ()
+    student_id, paid, subscription_end = student
+    course_ids = Student.courses_enlisted.through.objects.filter(
+        student_id=student_id
+    ).values_list("course_id", flat=True)
+    return (
+        student_id,
+        paid,
+        subscription_end.timestamp() if subscription_end else None,
+        # Packed as 8-byte ints, a lot smaller pickled than a set
+        array("q", sorted(course_ids)),
+    )
+
+
+def cached_entitlements(user_id):
+    key = entitlements_key(user_id)
+    cached = cache.get(key)
+    if cached is None:
+        cached = load_entitlements(user_id)
+        cache.set(key, cached, settings.ENTITLEMENTS_CACHE_TIMEOUT)
+    if not cached:
+        return None
+    student_id, paid, subscription_end, course_ids = cached
+    return Entitlements(student_id, paid, subscription_end, frozenset(course_ids))
+
+
+def entitlement_claims(user_id):
+    """The ``ent`` claim value for ``user_id``'s access tokens."""
+    # Stamp read first: a change racing with this lands on a newer stamp
+    version = entitlements_version(user_id)
+    entitlements = cached_entitlements(user_id)
+    if entitlements is None:
+        return None
+    return {
+        "sid": entitlements.student_id,
+        "paid": entitlements.paid,
+        "sub_end": entitlements.subscription_end,
+        "crs": encode_course_ids(entitlements.course_ids),
+        "v": version,
+    }
+
+
+def get_entitlements(user, token=None):
+    """
+    Return the Entitlements of ``user``, or None when it isn't a student.
+
+    ``token`` is the request's validated access token (``request.auth``);
+    its claims are used instead of the cache when claims are enabled.
+    """
+    if not user.is_authenticated:
+        return None
+    if (
+        settings.JWT_ENTITLEMENT_CLAIMS
+        and token is not None
+        and ENTITLEMENTS_CLAIM in token
+    ):
+        claims = token[ENTITLEMENTS_CLAIM]
+        if claims is None:
+            return None
+        if claims["v"] != entitlements_version(user.pk):
+            raise InvalidToken("Entitlements changed, the token must be refreshed.")
+        return Entitlements(
+            claims["sid"],
+            claims["paid"],
+            claims["sub_end"],
+            decode_course_ids(claims["crs"]),
+        )
+    return cached_entitlements(user.pk)
+
+
+def invalidate_entitlements(*user_ids):
+    """
+    Drop cached entitlements and bump the users' version stamps now and
+    again once the current transaction commits, in case a concurrent request
+    re-cached the old state meanwhile.
+    """
+    if not user_ids:
+        return
+
+    def invalidate():
+        cache.delete_many([entitlements_key(user_id) for user_id in user_ids])
+        for user_id in user_ids:
+            bump_entitlements_version(user_id)
+
+    invalidate()
+    transaction.on_commit(invalidate)
@@ -0,0 +1,169 @@
+"""
+Helpers for serving course images over plain HTTP: MIME sniffing, strong
+ETags, conditional requests and single byte-range requests.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+# (magic bytes, offset, content type)
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", 0, "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png"),
+    (b"GIF87a", 0, "image/gif"),
+    (b"GIF89a", 0, "image/gif"),
+    (b"WEBP", 8, "image/webp"),
+    (b"ftypavif", 4, "image/avif"),
+    (b"BM", 0, "image/bmp"),
+)
+
+# Length of the image hash prefix used as the ?v= cache buster
+IMAGE_VERSION_LENGTH = 16
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def sniff_content_type(data):
+    head = bytes(data[:16])
+    for magic, offset, content_type in IMAGE_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return content_type
+    return "application/octet-stream"
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_content_hash(storage, name):
+    """
+    content_hash of a stored file, remembered in the cache by the file's
+    size and modification time so that a file replaced under the same name
+    gets a new hash. Raises FileNotFoundError when the file is missing.
+    """
+    stamp = f"{name}:{storage.size(name)}:{storage.get_modified_time(name).timestamp()}"
+    key = "image:hash:" + hashlib.sha256(stamp.encode()).hexdigest()
+    digest = cache.get(key)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with storage.open(name) as f:
+            for chunk in f.chunks():
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        cache.set(key, digest, None)
+    return digest
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a ``Range`` header into an inclusive (start, end) pair.
+
+    Returns None when the header should be ignored (absent, malformed or
+    asking for several ranges) and raises UnsatisfiableRange when it can't
+    be served for a body of ``size`` bytes.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise UnsatisfiableRange
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise UnsatisfiableRange
+    return start, end
+
+
+def cache_control(max_age=None, immutable=False):
+    if max_age is None:
+        max_age = settings.COURSE_IMAGE_MAX_AGE
+    value = f"public, max-age={max_age}"
+    if immutable:
+        value += ", immutable"
+    return value
+
+
+def not_modified(request, etag):
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    # If-None-Match uses the weak comparison
+    return "*" in etags or quote_etag(etag) in etags or f"W/{quote_etag(etag)}" in etags
+
+
+def image_response(request, image, etag, cache_control_value=None):
+    """
+    Build the response for an image identified by ``etag`` (a content
+    hash), answering If-None-Match with 304 and Range with 206.
+
+    ``image`` is either the raw bytes or an open File, which is streamed.
+    """
+    headers = {
+        "ETag": quote_etag(etag),
+        "Cache-Control": cache_control_value or cache_control(),
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if not_modified(request, etag):
+        if isinstance(image, File):
+            image.close()
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    if isinstance(image, File):
+        size = image.size
+        content_type = sniff_content_type(image.read(16))
+        image.seek(0)
+    else:
+        size = len(image)
+        content_type = sniff_content_type(image)
+
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if not if_range or if_range == quote_etag(etag):
+        try:
+            byte_range = parse_byte_range(request.headers.get("Range"), size)
+        except UnsatisfiableRange:
+            if isinstance(image, File):
+                image.close()
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    if byte_range is None:
+        if isinstance(image, File):
+            response = FileResponse(image, content_type=content_type)
+        else:
+            response = HttpResponse(image, content_type=content_type)
+    else:
+        start, end = byte_range
+        if isinstance(image, File):
+            with image:
+                image.seek(start)
+                body = image.read(end - start + 1)
+        else:
+            body = image[start:end + 1]
+        response = HttpResponse(body, content_type=content_type, status=206)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,61 @@
+"""
+NOWPayments IPN signature verification on the raw request body.
+
+NOWPayments signs the callback's JSON with its keys sorted, HMAC-SHA512 with
+the IPN secret. The raw body is tried first (it is usually already in that
+form) and only otherwise parsed and re-serialized sorted. Requests with a
+missing or malformed signature, or an oversized body, are rejected before
+any hashing or parsing.
+"""
+import hashlib
+import hmac
+import json
+
+from django.conf import settings
+
+SIGNATURE_HEADER = "HTTP_X_NOWPAYMENTS_SIG"
+SIGNATURE_LENGTH = hashlib.sha512().digest_size * 2
+
+MAX_BODY_SIZE = 64 * 1024
+
+# Read once at startup rather than on every callback
+IPN_KEY = settings.IPN_KEY.encode()
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+def sign(body):
+    return hmac.new(IPN_KEY, body, hashlib.sha512).hexdigest().encode()
+
+
+def canonicalize(payload):
+    return json.dumps(payload, separators=(",", ":"), sort_keys=True).encode()
+
+
+def verify(body, signature):
+    """
+    Check ``signature`` (the header value) against the raw ``body`` bytes
+    and return the payload and its signed form. Raises InvalidSignature.
+    """
+    if not signature:
+        raise InvalidSignature("Signature missing")
+    if not IPN_KEY or len(signature) != SIGNATURE_LENGTH or len(body) > MAX_BODY_SIZE:
+        raise InvalidSignature("Invalid signature")
+    # Header values are latin-1 decoded, this gives their original bytes
+    signature = signature.lower().encode("latin-1", "replace")
+
+    signed = body
+    if not hmac.compare_digest(sign(body), signature):
+        try:
+            signed = canonicalize(json.loads(body))
+        except ValueError:
+            raise InvalidSignature("Invalid signature")
+        if not hmac.compare_digest(sign(signed), signature):
+            raise InvalidSignature("Invalid signature")
+
+    payload = json.loads(signed)
+    if not isinstance(payload, dict):
+        raise InvalidSignature("Invalid signature")
+    return payload, signed
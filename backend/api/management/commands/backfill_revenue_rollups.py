@@ -0,0 +1,89 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Lower, TruncDate
+
+from api.models import Payment, PaymentEvent, RevenueRollup
+from api.reports import add_to_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the revenue rollups from the applied finished events, and "
+        "refunds of finished payments, in the PaymentEvent log, one primary key range at a time, "
+        "dated like api.payments does by when the callback was received. "
+        "Stop process_ipn_inbox while it runs, payments it applies meanwhile "
+        "could be counted twice or not at all."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Number of payment event ids aggregated per transaction.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.05,
+            help="Seconds to pause between chunks to let other writers in.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        RevenueRollup.objects.all().delete()
+
+        # Amounts come from the payment, as in api.reports.record_payment
+        payment = Payment.objects.filter(payment_id=OuterRef("payment_id"))
+        # Refunds only count after the payment finished, as in api.payments
+        was_finished = PaymentEvent.objects.filter(
+            payment_id=OuterRef("payment_id"), payment_status="finished", applied=True
+        )
+        events = (
+            PaymentEvent.objects.filter(
+                Q(payment_status="finished")
+                | Q(Exists(was_finished), payment_status="refunded"),
+                Exists(payment),
+                applied=True,
+            )
+            .annotate(
+                subscription_type=Subquery(payment.values("subscription_type")[:1]),
+                currency=Lower(Subquery(payment.values("price_currency")[:1])),
+                amount=Subquery(payment.values("price_amount")[:1]),
+            )
+        )
+        finished = Q(payment_status="finished")
+        refunded = Q(payment_status="refunded")
+        last_pk = events.aggregate(last=Max("pk"))["last"] or 0
+        for start in range(0, last_pk, chunk_size):
+            totals = (
+                events.filter(pk__gt=start, pk__lte=start + chunk_size)
+                .values("subscription_type", "currency", day=TruncDate("received_at"))
+                .annotate(
+                    payments=Count("pk", filter=finished),
+                    revenue=Sum("amount", filter=finished, default=0),
+                    refunds=Count("pk", filter=refunded),
+                    refunded=Sum("amount", filter=refunded, default=0),
+                )
+                .order_by()
+            )
+            with transaction.atomic():
+                for row in totals:
+                    add_to_rollup(
+                        row["day"],
+                        row["currency"],
+                        row["subscription_type"],
+                        payments=row["payments"],
+                        revenue=row["revenue"],
+                        refunds=row["refunds"],
+                        refunded=row["refunded"],
+                    )
+            self.stdout.write(f"Aggregated payment events up to id {start + chunk_size}")
+            time.sleep(options["sleep"])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Done, {RevenueRollup.objects.count()} rollup rows.")
+        )
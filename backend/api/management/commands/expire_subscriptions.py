@@ -0,0 +1,75 @@
+import time
+from array import array
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.entitlements import invalidate_entitlements
+from api.models import Student
+from api.usercache import bump_user_versions
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark students whose subscription has ended as unpaid and remove "
+        "their PAID course enrollments. Meant to run periodically (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of students whose enrollments are deleted per transaction.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.05,
+            help="Seconds to pause between batches to let other writers in.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        # The cutoff is fixed here, the scan and the update below share it
+        expired = Student.objects.expired()
+
+        # Plain ids only, read off the (paid, subscription_end) index
+        student_ids, user_ids = array("q"), array("q")
+        for student_id, user_id in expired.values_list("pk", "user_id").iterator():
+            student_ids.append(student_id)
+            user_ids.append(user_id)
+        if not student_ids:
+            self.stdout.write(self.style.SUCCESS("No expired subscriptions."))
+            return
+
+        # Students who renewed since the scan no longer match and are skipped
+        flipped = expired.update(paid=False)
+        self.stdout.write(f"Marked {flipped} students as unpaid")
+
+        enrollments = Student.courses_enlisted.through.objects.filter(
+            course__category="PAID",
+            # Someone may have renewed in between, keep their courses
+            student__paid=False,
+        )
+        removed = 0
+        for start in range(0, len(student_ids), batch_size):
+            batch = student_ids[start : start + batch_size].tolist()
+            batch_user_ids = user_ids[start : start + batch_size].tolist()
+            with transaction.atomic():
+                removed += enrollments.filter(student_id__in=batch).delete()[0]
+                # Bulk statements skip the signals that expire cached state
+                invalidate_entitlements(*batch_user_ids)
+                bump_user_versions(*batch_user_ids)
+            self.stdout.write(
+                f"Removed {removed} paid enrollments "
+                f"({min(start + batch_size, len(student_ids))}/{len(student_ids)} students)"
+            )
+            time.sleep(options["sleep"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done, {flipped} subscriptions expired and {removed} paid "
+                "enrollments removed."
+            )
+        )
@@ -0,0 +1,74 @@
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+
+from api.cache import bump_catalog_version
+from api.models import Course
+from api.storage import content_hash_from_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Move Course.image/image_blob bytes into the content-addressed image "
+        "store, one row at a time, and clear the in-row columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of course ids fetched per batch.",
+        )
+        parser.add_argument(
+            "--vacuum",
+            action="store_true",
+            help="Run VACUUM afterwards to give the space back (SQLite only).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        storage = Course._meta.get_field("image_file").storage
+        pending = Course.objects.filter(
+            Q(image__isnull=False) | Q(image_blob__isnull=False)
+        )
+
+        moved = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                pending.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            for pk in pks:
+                # Only a single image is held in memory at any time
+                data = (
+                    Course.objects.filter(pk=pk)
+                    .values_list(Coalesce("image", "image_blob"), flat=True)
+                    .first()
+                )
+                fields = {"image": None, "image_blob": None}
+                if data:
+                    name = storage.save("image", ContentFile(bytes(data)))
+                    fields.update(
+                        image_file=name, image_hash=content_hash_from_name(name)
+                    )
+                    moved += 1
+                Course.objects.filter(pk=pk).update(**fields)
+                del data
+            last_pk = pks[-1]
+            self.stdout.write(f"Moved {moved} images (up to course {last_pk})")
+
+        # Bulk updates skip the post_save signal that expires cached payloads
+        bump_catalog_version()
+
+        if options["vacuum"] and connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {moved} images moved."))
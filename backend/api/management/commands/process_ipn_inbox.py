@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.payments import process_inbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the NOWPayments IPN callbacks waiting in the inbox, in batches. "
+        "With --follow it keeps polling for new ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of inbox messages applied per batch.",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Give up on a message after this many failed attempts.",
+        )
+        parser.add_argument(
+            "--retry-delay",
+            type=float,
+            default=60,
+            help="Seconds before a failed message is retried, doubled on each "
+            "further failure.",
+        )
+        parser.add_argument(
+            "--follow",
+            action="store_true",
+            help="Keep running and poll the inbox once it is drained.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2.0,
+            help="Seconds between polls of an empty inbox with --follow.",
+        )
+
+    def handle(self, *args, **options):
+        handled = 0
+        while True:
+            count = process_inbox(
+                options["batch_size"], options["max_attempts"], options["retry_delay"]
+            )
+            handled += count
+            if count:
+                self.stdout.write(f"Handled {handled} IPN messages")
+            elif options["follow"]:
+                time.sleep(options["interval"])
+            else:
+                break
+        self.stdout.write(self.style.SUCCESS(f"Done, {handled} IPN messages handled."))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding and blacklisted refresh tokens in small "
+        "batches, each in its own short transaction, so the database stays "
+        "writable while it runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of expired tokens deleted per transaction.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.05,
+            help="Seconds to pause between batches to let other writers in.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        # Fixed cutoff so the job ends even while new tokens keep expiring
+        expired = OutstandingToken.objects.filter(expires_at__lte=aware_utcnow())
+
+        deleted = 0
+        while True:
+            pks = list(
+                expired.order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                BlacklistedToken.objects.filter(token_id__in=pks).delete()
+                OutstandingToken.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+            self.stdout.write(f"Deleted {deleted} expired tokens")
+            time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {deleted} expired tokens deleted."))
@@ -1,6 +1,15 @@
+from datetime import timedelta
+
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models import Case, Value, When
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+SUBSCRIPTION_ACTIVE = "active"
+SUBSCRIPTION_EXPIRED = "expired"
+SUBSCRIPTION_NONE = "none"
+
 
 class CustomUserManager(BaseUserManager):
     """
@@ -31,4 +40,48 @@ class CustomUserManager(BaseUserManager):
             raise ValueError(_("Superuser must have is_staff=True."))
         if extra_fields.get("is_superuser") is not True:
             raise ValueError(_("Superuser must have is_superuser=True."))
-        return self.create_user(email, password, username, **extra_fields)
\ No newline at end of file
+        return self.create_user(email, password, username, **extra_fields)
+
+
+def subscription_state(prefix=""):
+    """
+    Expression for a student's subscription state, one of ``active``,
+    ``expired`` or ``none``. ``prefix`` is the lookup path to the Student
+    (e.g. ``"student__"`` from CustomUser).
+    """
+    now = timezone.now()
+    return Case(
+        When(
+            **{f"{prefix}paid": True, f"{prefix}subscription_end__gt": now},
+            then=Value(SUBSCRIPTION_ACTIVE),
+        ),
+        When(
+            **{f"{prefix}paid": True, f"{prefix}subscription_end__lte": now},
+            then=Value(SUBSCRIPTION_EXPIRED),
+        ),
+        default=Value(SUBSCRIPTION_NONE),
+        output_field=models.CharField(),
+    )
+
+
+class StudentQuerySet(models.QuerySet):
+    """
+    Subscription filters evaluated in SQL, all served by the
+    (paid, subscription_end) index.
+    """
+    def active(self):
+        return self.filter(paid=True, subscription_end__gt=timezone.now())
+
+    def expiring_within(self, days):
+        now = timezone.now()
+        return self.filter(
+            paid=True,
+            subscription_end__gt=now,
+            subscription_end__lte=now + timedelta(days=days),
+        )
+
+    def expired(self):
+        return self.filter(paid=True, subscription_end__lte=timezone.now())
+
+    def with_subscription_state(self):
+        return self.annotate(subscription_state=subscription_state())
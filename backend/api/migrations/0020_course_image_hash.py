@@ -0,0 +1,40 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:04
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def hash_course_images(apps, schema_editor):
+    Course = apps.get_model("api", "Course")
+    pks = list(Course.objects.values_list("pk", flat=True))
+    # Read the image column one row at a time to keep memory bounded
+    for pk in pks:
+        data = (
+            Course.objects.filter(pk=pk)
+            .values_list(Coalesce("image", "image_blob"), flat=True)
+            .first()
+        )
+        if data:
+            Course.objects.filter(pk=pk).update(
+                image_hash=hashlib.sha256(data).hexdigest()
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_course_image_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="image_hash",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.RunPython(hash_course_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:06
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0020_course_image_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="image_file",
+            field=models.FileField(
+                blank=True,
+                editable=False,
+                storage=api.storage.course_image_storage,
+                upload_to="",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0021_course_image_file"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="course",
+            index=models.Index(
+                fields=["publication_date", "id"], name="course_publication_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="lesson",
+            index=models.Index(
+                fields=["curriculum", "sequence_number", "id"],
+                name="lesson_sequence_idx",
+            ),
+        ),
+    ]
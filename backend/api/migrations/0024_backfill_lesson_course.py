@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_lesson_course(apps, schema_editor):
+    Lesson = apps.get_model("api", "Lesson")
+    Curriculum = apps.get_model("api", "Curriculum")
+    course_id = Subquery(
+        Curriculum.objects.filter(pk=OuterRef("curriculum_id")).values("course_id")[:1]
+    )
+    last_pk = Lesson.objects.aggregate(last=Max("pk"))["last"] or 0
+    # One short UPDATE per primary key range, each committed on its own
+    for start in range(0, last_pk, BATCH_SIZE):
+        Lesson.objects.filter(
+            pk__gt=start, pk__lte=start + BATCH_SIZE, course__isnull=True
+        ).update(course_id=course_id)
+
+
+class Migration(migrations.Migration):
+
+    # Commit every batch instead of holding one long write lock
+    atomic = False
+
+    dependencies = [
+        ("api", "0023_lesson_course"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_lesson_course, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,107 @@
+from django.db import migrations
+
+# rowid = object id * 4 + kind (1 course, 2 curriculum, 3 lesson), see api.search
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE api_search_index USING fts5(
+        title, body, course_id UNINDEXED, tokenize = 'porter unicode61'
+    )
+    """,
+    # Titles weigh ten times more than bodies in ORDER BY rank
+    "INSERT INTO api_search_index(api_search_index, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    """
+    CREATE TRIGGER api_search_course_insert AFTER INSERT ON api_course BEGIN
+        INSERT INTO api_search_index(rowid, title, body, course_id)
+        VALUES (new.id * 4 + 1, new.title, new.description, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER api_search_course_update AFTER UPDATE OF title, description ON api_course BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 4 + 1;
+        INSERT INTO api_search_index(rowid, title, body, course_id)
+        VALUES (new.id * 4 + 1, new.title, new.description, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER api_search_course_delete AFTER DELETE ON api_course BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 4 + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER api_search_curriculum_insert AFTER INSERT ON api_curriculum BEGIN
+        INSERT INTO api_search_index(rowid, title, body, course_id)
+        VALUES (new.id * 4 + 2, new.title, new.description, new.course_id);
+    END
+    """,
+    """
+    CREATE TRIGGER api_search_curriculum_update AFTER UPDATE OF title, description, course_id ON api_curriculum BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 4 + 2;
+        INSERT INTO api_search_index(rowid, title, body, course_id)
+        VALUES (new.id * 4 + 2, new.title, new.description, new.course_id);
+    END
+    """,
+    """
+    CREATE TRIGGER api_search_curriculum_delete AFTER DELETE ON api_curriculum BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 4 + 2;
+    END
+    """,
+    """
+    CREATE TRIGGER api_search_lesson_insert AFTER INSERT ON api_lesson BEGIN
+        INSERT INTO api_search_index(rowid, title, body, course_id)
+        VALUES (new.id * 4 + 3, new.title, new.content, new.course_id);
+    END
+    """,
+    """
+    CREATE TRIGGER api_search_lesson_update AFTER UPDATE OF title, content, course_id ON api_lesson BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 4 + 3;
+        INSERT INTO api_search_index(rowid, title, body, course_id)
+        VALUES (new.id * 4 + 3, new.title, new.content, new.course_id);
+    END
+    """,
+    """
+    CREATE TRIGGER api_search_lesson_delete AFTER DELETE ON api_lesson BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 4 + 3;
+    END
+    """,
+    # Index what already exists
+    """
+    INSERT INTO api_search_index(rowid, title, body, course_id)
+    SELECT id * 4 + 1, title, description, id FROM api_course
+    """,
+    """
+    INSERT INTO api_search_index(rowid, title, body, course_id)
+    SELECT id * 4 + 2, title, description, course_id FROM api_curriculum
+    """,
+    """
+    INSERT INTO api_search_index(rowid, title, body, course_id)
+    SELECT id * 4 + 3, title, content, course_id FROM api_lesson
+    """,
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS api_search_{table}_{action}"
+    for table in ("course", "curriculum", "lesson")
+    for action in ("insert", "update", "delete")
+] + ["DROP TABLE IF EXISTS api_search_index"]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # FTS5 is SQLite only, search is disabled on other databases
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0024_backfill_lesson_course"),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SQL), run(DROP_SQL)),
+    ]
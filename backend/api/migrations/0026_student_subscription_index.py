@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0025_search_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(
+                fields=["paid", "subscription_end"], name="student_subscription_idx"
+            ),
+        ),
+    ]
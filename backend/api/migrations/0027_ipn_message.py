@@ -0,0 +1,50 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0026_student_subscription_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IPNMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payment_id", models.CharField(max_length=255)),
+                ("payment_status", models.CharField(max_length=50)),
+                ("payload", models.TextField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("processed_at__isnull", True)),
+                        fields=["id"],
+                        name="ipn_message_pending_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="ipnmessage",
+            constraint=models.UniqueConstraint(
+                fields=("payment_id", "payment_status"),
+                name="ipn_message_unique_status",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0027_ipn_message"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payment_id", models.CharField(max_length=255)),
+                ("payment_status", models.CharField(max_length=50)),
+                ("applied", models.BooleanField()),
+                (
+                    "pay_amount",
+                    models.DecimalField(
+                        blank=True, decimal_places=12, max_digits=30, null=True
+                    ),
+                ),
+                ("pay_currency", models.CharField(blank=True, max_length=50)),
+                (
+                    "price_amount",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=20, null=True
+                    ),
+                ),
+                ("price_currency", models.CharField(blank=True, max_length=50)),
+                ("received_at", models.DateTimeField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["payment_id", "received_at"],
+                        name="payment_event_history_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0028_payment_event"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevenueRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("currency", models.CharField(max_length=50)),
+                ("subscription_type", models.CharField(max_length=50)),
+                ("payments", models.PositiveIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=20),
+                ),
+                ("refunds", models.PositiveIntegerField(default=0)),
+                (
+                    "refunded",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=20),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="revenuerollup",
+            constraint=models.UniqueConstraint(
+                fields=("day", "currency", "subscription_type"),
+                name="revenue_rollup_unique_bucket",
+            ),
+        ),
+    ]
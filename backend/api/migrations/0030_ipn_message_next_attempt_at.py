@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0029_revenue_rollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ipnmessage",
+            name="next_attempt_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
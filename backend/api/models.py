@@ -1,10 +1,12 @@
 from django.contrib.auth.models import AbstractUser, PermissionsMixin
+from django.core.files.base import ContentFile
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 # Create your models here.
-from .manager import CustomUserManager
+from .manager import CustomUserManager, StudentQuerySet
+from .storage import content_hash_from_name, course_image_storage
 
 class CustomUser(AbstractUser, PermissionsMixin):
     STUDENT = 1
@@ -50,32 +52,79 @@ class Student(UserProfile):
     subscription_start = models.DateTimeField(null=True, blank=True)
     subscription_end = models.DateTimeField(null=True, blank=True)
 
+    objects = StudentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Finds expired/expiring subscriptions (expire_subscriptions)
+            models.Index(fields=["paid", "subscription_end"], name="student_subscription_idx"),
+        ]
+
     @property
     def has_active_subscription(self):
-        return self.paid and self.subscription_end > timezone.now()
+        return (
+            self.paid
+            and self.subscription_end is not None
+            and self.subscription_end > timezone.now()
+        )
 
     def update_courses_enlisted(self):
         if not self.has_active_subscription:
             self.courses_enlisted.remove(*self.courses_enlisted.filter(category="PAID"))
 
+    SUBSCRIPTION_FIELDS = ("paid", "subscription_start", "subscription_end")
+
+    def renew_subscription(self, duration_months):
+        """
+        Start a subscription, or extend it if it's still active, in a single
+        UPDATE so concurrent renewals (double clicks, IPN retries) all count.
+        """
+        now = timezone.now()
+        length = timezone.timedelta(days=int(duration_months) * 30)
+        active = models.Q(paid=True, subscription_end__gt=now)
+        Student.objects.filter(pk=self.pk).update(
+            paid=True,
+            subscription_start=models.Case(
+                models.When(active, then=models.F("subscription_start")),
+                default=models.Value(now),
+            ),
+            subscription_end=models.Case(
+                models.When(active, then=models.F("subscription_end") + length),
+                default=models.Value(now + length),
+            ),
+        )
+        self.subscription_changed()
+
     def subscribe(self, duration_months):
-        self.paid = True
-        self.subscription_start = timezone.now()
-        self.subscription_end = self.subscription_start + timezone.timedelta(days=duration_months * 30)
-        self.save()
+        self.renew_subscription(duration_months)
 
     def extend_subscription(self, duration_months):
-        if self.has_active_subscription:
-            print("extending")
-            self.subscription_end += timezone.timedelta(days=duration_months * 30)
-            self.save()
+        """Extend an active subscription, returns False if there is none."""
+        length = timezone.timedelta(days=int(duration_months) * 30)
+        extended = Student.objects.filter(
+            pk=self.pk, paid=True, subscription_end__gt=timezone.now()
+        ).update(subscription_end=models.F("subscription_end") + length)
+        self.subscription_changed()
+        return bool(extended)
 
     def cancel_subscription(self):
-        self.paid = False
-        self.subscription_start = None
-        self.subscription_end = None
+        Student.objects.filter(pk=self.pk).update(
+            paid=False, subscription_start=None, subscription_end=None
+        )
+        self.subscription_changed()
         self.update_courses_enlisted()  # Clear paid courses only
-        self.save()
+
+    def subscription_changed(self):
+        """
+        Reload the subscription fields after an UPDATE and expire the cached
+        state that post_save would have (the UPDATE doesn't send it).
+        """
+        from .entitlements import invalidate_entitlements
+        from .usercache import bump_user_versions
+
+        self.refresh_from_db(fields=self.SUBSCRIPTION_FIELDS)
+        invalidate_entitlements(self.user_id)
+        bump_user_versions(self.user_id)
 
 class Course(models.Model):
        
@@ -97,6 +146,10 @@ class Course(models.Model):
     category = models.CharField(choices=PAYMENT, max_length=4)
     image = models.BinaryField( blank=True, null=True) 
     image_blob = models.BinaryField( blank=True, null=True) 
+    # Out-of-row copy of image/image_blob, see store_image()
+    image_file = models.FileField(storage=course_image_storage, blank=True, editable=False)
+    # sha256 of the served image, maintained by save(); used to version image URLs
+    image_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
     image1 = models.ImageField(upload_to='post_images')
     image2 = models.ImageField(upload_to='post_images')
     image3 = models.ImageField(upload_to='post_images')
@@ -104,10 +157,49 @@ class Course(models.Model):
     difficulty = models.CharField(choices=DIFFICULTY, max_length=20)
   
     instructor = models.ForeignKey(Instructor, on_delete=models.CASCADE, blank=False, null=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order of CourseViewSet
+            models.Index(fields=["publication_date", "id"], name="course_publication_idx"),
+        ]
   
     def __str__(self):
         return self.title
 
+    IMAGE_FIELDS = ("image", "image_blob", "image_file", "image_hash")
+
+    def store_image(self, data):
+        """
+        Move raw image bytes into the content-addressed store and clear the
+        in-row binary columns.
+        """
+        name = self.image_file.storage.save("image", ContentFile(bytes(data)))
+        self.image_file.name = name
+        self.image_hash = content_hash_from_name(name)
+        self.image = None
+        self.image_blob = None
+
+    def read_image(self):
+        # Prefer the stored file, fall back to rows that weren't offloaded yet
+        if self.image_file:
+            with self.image_file.storage.open(self.image_file.name) as f:
+                return f.read()
+        return self.image or self.image_blob
+
+    def save(self, *args, **kwargs):
+        # Offload bytes written to the binary columns, when they are loaded
+        if not {"image", "image_blob"} & self.get_deferred_fields():
+            data = self.image or self.image_blob
+            if data:
+                self.store_image(data)
+            elif not self.image_file:
+                self.image_hash = ""
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, *self.IMAGE_FIELDS}
+        super().save(*args, **kwargs)
+
 class Curriculum(models.Model):
    
     DIFFICULTY = (
@@ -127,6 +219,11 @@ class Curriculum(models.Model):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Keep Lesson.course in sync when the curriculum moves to another course
+        self.lessons.exclude(course_id=self.course_id).update(course_id=self.course_id)
+
 
 class Lesson(models.Model):
     title = models.CharField(max_length=200)
@@ -137,9 +234,36 @@ class Lesson(models.Model):
     duration = models.CharField(max_length=100)
     
     curriculum = models.ForeignKey(Curriculum, on_delete=models.CASCADE, related_name='lessons')
+    # Denormalized curriculum.course, maintained by save() and Curriculum.save()
+    course = models.ForeignKey(
+        Course, on_delete=models.CASCADE, null=True, blank=True, editable=False,
+        related_name='lessons', db_index=False,
+    )
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order of LessonViewSet
+            models.Index(fields=["curriculum", "sequence_number", "id"], name="lesson_sequence_idx"),
+            # Entitlement filtering (course_id IN ...) in the same order
+            models.Index(fields=["course", "curriculum", "sequence_number", "id"], name="lesson_course_idx"),
+        ]
 
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        if Lesson.curriculum.is_cached(self):
+            self.course_id = self.curriculum.course_id
+        else:
+            self.course_id = (
+                Curriculum.objects.filter(pk=self.curriculum_id)
+                .values_list("course_id", flat=True)
+                .first()
+            )
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "course"}
+        super().save(*args, **kwargs)
     
 
 class Payment(models.Model):
@@ -156,8 +280,81 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
-    def _str_(self):
-        return f"{self.payment_id} - {self.status}"
+    def __str__(self):
+        return f"{self.payment_id} - {self.payment_status}"
+
+class IPNMessage(models.Model):
+    """
+    Inbox of verified NOWPayments IPN callbacks. The webhook only stores the
+    raw payload here; the process_ipn_inbox command applies them later.
+    """
+    payment_id = models.CharField(max_length=255)
+    payment_status = models.CharField(max_length=50)
+    payload = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Failed messages are retried with exponential backoff (api.payments)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            # Retried callbacks for the same status are dropped on insert
+            models.UniqueConstraint(fields=["payment_id", "payment_status"], name="ipn_message_unique_status"),
+        ]
+        indexes = [
+            # What the worker drains, in arrival order
+            models.Index(fields=["id"], condition=models.Q(processed_at__isnull=True), name="ipn_message_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.payment_id} - {self.payment_status}"
+
+class PaymentEvent(models.Model):
+    """
+    Append-only log of the IPN callbacks applied to payments, one row per
+    callback whether or not it changed the payment's status.
+    """
+    payment_id = models.CharField(max_length=255)
+    payment_status = models.CharField(max_length=50)
+    applied = models.BooleanField()
+    pay_amount = models.DecimalField(max_digits=30, decimal_places=12, null=True, blank=True)
+    pay_currency = models.CharField(max_length=50, blank=True)
+    price_amount = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    price_currency = models.CharField(max_length=50, blank=True)
+    received_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a payment's history
+            models.Index(fields=["payment_id", "received_at"], name="payment_event_history_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.payment_id} - {self.payment_status}"
+
+class RevenueRollup(models.Model):
+    """
+    Payment totals per day, currency and subscription type, maintained as
+    payments reach finished or refunded (see api.reports).
+    """
+    day = models.DateField()
+    currency = models.CharField(max_length=50)
+    subscription_type = models.CharField(max_length=50)
+    payments = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    refunds = models.PositiveIntegerField(default=0)
+    refunded = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # One row per bucket, also serves the reports' date range scans
+            models.UniqueConstraint(fields=["day", "currency", "subscription_type"], name="revenue_rollup_unique_bucket"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.currency} {self.subscription_type}"
 
 class ContactMessage(models.Model):
     first_name = models.CharField(max_length=100)
@@ -0,0 +1,163 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over a composite, unique ordering.
+
+    Views set ``keyset_ordering`` to a tuple of field names ending with a
+    unique one, e.g. ``("publication_date", "id")``; a ``-`` prefix sorts
+    descending. The cursor is an opaque encoding of the first/last row's
+    values and each page is fetched with a ``WHERE (a, b) > (x, y)``
+    condition, so deep pages cost the same as the first one.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("id",)
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE or 20
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(getattr(view, "keyset_ordering", self.ordering))
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+
+        backwards = cursor is not None and cursor["d"] == "p"
+        if cursor is not None:
+            queryset = queryset.filter(self.seek(cursor["v"], backwards))
+        ordering = self.reversed_ordering() if backwards else self.ordering
+        rows = list(queryset.order_by(*ordering)[: self.page_size + 1])
+
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if backwards:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor("n", self.rows[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            # Paged past the end, go back to the start
+            return remove_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param
+            )
+        return self.encode_cursor("p", self.rows[0])
+
+    def reversed_ordering(self):
+        return tuple(
+            field[1:] if field.startswith("-") else "-" + field
+            for field in self.ordering
+        )
+
+    def seek(self, values, backwards):
+        """
+        Build ``(f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...`` for the ordering,
+        flipping the comparison for descending fields and backwards paging.
+        """
+        clauses = []
+        for position, field in enumerate(self.ordering):
+            descending = field.startswith("-")
+            name = field.lstrip("-")
+            lookup = "lt" if descending != backwards else "gt"
+            equal = {
+                previous.lstrip("-"): value
+                for previous, value in zip(self.ordering[:position], values)
+            }
+            clauses.append(Q(**equal, **{f"{name}__{lookup}": values[position]}))
+        return reduce(or_, clauses)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if cursor["d"] not in ("n", "p") or len(cursor["v"]) != len(self.ordering):
+                raise ValueError
+            # The cursor comes from the client, check each value against
+            # its field before it reaches the query
+            cursor["v"] = [
+                self.to_python(model, field, value)
+                for field, value in zip(self.ordering, cursor["v"])
+            ]
+        except (
+            TypeError,
+            ValueError,
+            KeyError,
+            binascii.Error,
+            ValidationError,
+            FieldDoesNotExist,
+        ):
+            raise NotFound("Invalid cursor.")
+        return cursor
+
+    def to_python(self, model, field, value):
+        if value is None or isinstance(value, (dict, list)):
+            raise ValueError
+        return model._meta.get_field(field.lstrip("-")).to_python(value)
+
+    def encode_cursor(self, direction, row):
+        values = []
+        for field in self.ordering:
+            value = getattr(row, field.lstrip("-"))
+            if isinstance(value, (date, datetime)):
+                value = value.isoformat()
+            values.append(value)
+        encoded = base64.urlsafe_b64encode(
+            json.dumps({"d": direction, "v": values}, separators=(",", ":")).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, encoded
+        )
@@ -0,0 +1,172 @@
+"""
+Application of NOWPayments IPN callbacks, run by the process_ipn_inbox
+command on the messages IPNCallbackView stored in the IPNMessage inbox.
+"""
+import json
+import logging
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import IPNMessage, Payment, PaymentEvent
+from .reports import record_payment
+
+logger = logging.getLogger(__name__)
+
+# NOWPayments payment_status -> statuses a payment may move to it from.
+# "waiting" is where SaveInvoiceView starts every payment. Anything not
+# listed (a late "confirming" after "finished", a repeated status) is
+# ignored, so callbacks can arrive out of order or more than once.
+TRANSITIONS = {
+    "waiting": (),
+    "confirming": ("waiting",),
+    "confirmed": ("waiting", "confirming"),
+    "sending": ("waiting", "confirming", "confirmed"),
+    "partially_paid": ("waiting", "confirming", "confirmed", "sending"),
+    "finished": ("waiting", "confirming", "confirmed", "sending", "partially_paid"),
+    "failed": ("waiting", "confirming", "confirmed", "sending", "partially_paid"),
+    "expired": ("waiting", "partially_paid"),
+    "refunded": ("partially_paid", "finished"),
+}
+
+
+class IPNError(Exception):
+    pass
+
+
+def transition(payment_id, payment_status, from_statuses=None):
+    """
+    Move a payment to ``payment_status`` if its current status allows it, in
+    a single conditional UPDATE. ``from_statuses`` narrows the statuses
+    allowed by TRANSITIONS. Returns whether the transition applied.
+    """
+    if from_statuses is None:
+        from_statuses = TRANSITIONS[payment_status]
+    return bool(
+        Payment.objects.filter(
+            payment_id=payment_id, payment_status__in=from_statuses
+        ).update(payment_status=payment_status, updated_at=timezone.now())
+    )
+
+
+def event_decimal(field_name, value):
+    """
+    ``value`` rounded to the PaymentEvent field's decimal places, or None
+    if it isn't a number or doesn't fit the field.
+    """
+    field = PaymentEvent._meta.get_field(field_name)
+    try:
+        number = Decimal(str(value)).quantize(Decimal(1).scaleb(-field.decimal_places))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    if not number.is_finite() or number.adjusted() >= (
+        field.max_digits - field.decimal_places
+    ):
+        return None
+    return number
+
+
+def event_text(field_name, value):
+    return str(value or "")[: PaymentEvent._meta.get_field(field_name).max_length]
+
+
+def payment_event(message, data, applied):
+    return PaymentEvent(
+        payment_id=message.payment_id,
+        payment_status=message.payment_status,
+        applied=applied,
+        pay_amount=event_decimal("pay_amount", data.get("pay_amount")),
+        pay_currency=event_text("pay_currency", data.get("pay_currency")),
+        price_amount=event_decimal("price_amount", data.get("price_amount")),
+        price_currency=event_text("price_currency", data.get("price_currency")),
+        received_at=message.received_at,
+    )
+
+
+def apply_ipn(message):
+    """
+    Apply one IPNMessage to its Payment (and the student's subscription).
+    Returns an unsaved PaymentEvent recording it, which the caller saves in
+    the same transaction.
+    """
+    data = json.loads(message.payload)
+    payment_status = data.get("payment_status")
+    if payment_status not in TRANSITIONS:
+        raise IPNError(f"Unhandled payment status {payment_status!r}")
+
+    # Only a refund of a finished payment takes back revenue the rollups
+    # counted, a partially paid one was never counted
+    refund_of_revenue = payment_status == "refunded" and transition(
+        message.payment_id, payment_status, ("finished",)
+    )
+    if not refund_of_revenue and not transition(message.payment_id, payment_status):
+        if not Payment.objects.filter(payment_id=message.payment_id).exists():
+            raise IPNError(f"Payment {message.payment_id} not found")
+        logger.info(
+            "Ignored %s for payment %s, not reachable from its current status",
+            payment_status,
+            message.payment_id,
+        )
+        return payment_event(message, data, applied=False)
+
+    if payment_status == "finished" or refund_of_revenue:
+        payment = Payment.objects.select_related("student").get(
+            payment_id=message.payment_id
+        )
+        record_payment(
+            payment, payment_status, timezone.localdate(message.received_at)
+        )
+    if payment_status == "finished":
+        payment.student.renew_subscription(payment.duration_months)
+        logger.info(
+            "Subscription renewed for student %s by payment %s",
+            payment.student_id,
+            payment.payment_id,
+        )
+    logger.info(
+        "Payment %s is %s. Order ID: %s",
+        message.payment_id,
+        payment_status,
+        data.get("order_id"),
+    )
+    return payment_event(message, data, applied=True)
+
+
+def retry_delay(attempts, base_delay):
+    """Backoff before the next attempt of a message that failed ``attempts`` times."""
+    return timedelta(seconds=base_delay * 2 ** (attempts - 1))
+
+
+def process_inbox(batch_size=100, max_attempts=5, base_delay=60):
+    """
+    Apply a batch of pending inbox messages in arrival order, each in its
+    own transaction along with its PaymentEvent, so a message is never
+    marked processed without its event. A failed message is retried after
+    ``base_delay`` seconds, doubled on each further failure. Returns the
+    number of messages handled.
+    """
+    messages = list(
+        IPNMessage.objects.filter(
+            processed_at__isnull=True,
+            attempts__lt=max_attempts,
+            next_attempt_at__lte=timezone.now(),
+        ).order_by("id")[:batch_size]
+    )
+    for message in messages:
+        try:
+            with transaction.atomic():
+                apply_ipn(message).save()
+                IPNMessage.objects.filter(pk=message.pk).update(
+                    processed_at=timezone.now(), attempts=message.attempts + 1, error=""
+                )
+        except Exception as e:
+            logger.exception("IPN message %s failed", message.pk)
+            attempts = message.attempts + 1
+            IPNMessage.objects.filter(pk=message.pk).update(
+                attempts=attempts,
+                next_attempt_at=timezone.now() + retry_delay(attempts, base_delay),
+                error=str(e),
+            )
+    return len(messages)
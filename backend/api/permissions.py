@@ -1,25 +1,21 @@
 from rest_framework.permissions import BasePermission
-from .models import Lesson, Student
+from .entitlements import get_entitlements
 
 class IsPaidStudent(BasePermission):
     def has_permission(self, request, view):
-        # Check if user is authenticated
-        if not request.user.is_authenticated:
-            return False
-        
-        # Check if user is a student
-        if not hasattr(request.user, 'student'):
-            return False
-
-        return True
+        # Only students have entitlements
+        return get_entitlements(request.user, request.auth) is not None
 
     def has_object_permission(self, request, view, obj):
         # obj here is a Lesson instance
-        course = obj.curriculum.course
-        student = request.user.student
+        course = obj.course
+        if course is None:
+            # Lesson.course not filled in yet, nothing to check access against
+            return False
+        entitlements = get_entitlements(request.user, request.auth)
 
         # If the course is paid, ensure the student has paid
         if course.category == "PAID":
-            return student.paid and course in student.courses_enlisted.all()
+            return entitlements.paid and entitlements.is_enrolled(course.pk)
         
         return True
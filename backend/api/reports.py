@@ -0,0 +1,111 @@
+"""
+Revenue rollups: running totals per day, currency and subscription type in
+RevenueRollup, bumped by api.payments when a payment finishes or a finished
+payment is refunded, and rebuilt from history by backfill_revenue_rollups. Reports read
+only these rows, never the Payment table.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .models import RevenueRollup
+
+BUCKETS = {
+    "day": F("day"),
+    "week": TruncWeek("day"),
+    "month": TruncMonth("day"),
+}
+
+
+def add_to_rollup(
+    day, currency, subscription_type, payments=0, revenue=0, refunds=0, refunded=0
+):
+    """Add to a bucket's totals, creating the row the first time."""
+    bucket = RevenueRollup.objects.filter(
+        day=day, currency=currency, subscription_type=subscription_type
+    )
+    increments = {
+        "payments": F("payments") + payments,
+        "revenue": F("revenue") + revenue,
+        "refunds": F("refunds") + refunds,
+        "refunded": F("refunded") + refunded,
+    }
+    if bucket.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            RevenueRollup.objects.create(
+                day=day,
+                currency=currency,
+                subscription_type=subscription_type,
+                payments=payments,
+                revenue=revenue,
+                refunds=refunds,
+                refunded=refunded,
+            )
+    except IntegrityError:
+        # Created by a concurrent worker in the meantime
+        bucket.update(**increments)
+
+
+def record_payment(payment, payment_status, day):
+    """
+    Count a payment that just became finished, or was refunded after it
+    finished, on ``day``, the date its callback was received.
+    """
+    currency = payment.price_currency.lower()
+    if payment_status == "finished":
+        add_to_rollup(
+            day,
+            currency,
+            payment.subscription_type,
+            payments=1,
+            revenue=payment.price_amount,
+        )
+    elif payment_status == "refunded":
+        add_to_rollup(
+            day,
+            currency,
+            payment.subscription_type,
+            refunds=1,
+            refunded=payment.price_amount,
+        )
+
+
+def money(value):
+    return str(Decimal(value).quantize(Decimal("0.01")))
+
+
+def revenue_report(bucket, start, end, currency=None, subscription_type=None):
+    """Totals per ``bucket`` ("day", "week" or "month") between two dates."""
+    rollups = RevenueRollup.objects.filter(day__gte=start, day__lte=end)
+    if currency:
+        rollups = rollups.filter(currency=currency.lower())
+    if subscription_type:
+        rollups = rollups.filter(subscription_type=subscription_type)
+    rows = (
+        rollups.annotate(period=BUCKETS[bucket])
+        .values("period", "currency", "subscription_type")
+        .annotate(
+            total_payments=Sum("payments"),
+            total_revenue=Sum("revenue"),
+            total_refunds=Sum("refunds"),
+            total_refunded=Sum("refunded"),
+        )
+        .order_by("period", "currency", "subscription_type")
+    )
+    return [
+        {
+            "period": row["period"],
+            "currency": row["currency"],
+            "subscription_type": row["subscription_type"],
+            "payments": row["total_payments"],
+            "revenue": money(row["total_revenue"]),
+            "refunds": row["total_refunds"],
+            "refunded": money(row["total_refunded"]),
+            "net": money(row["total_revenue"] - row["total_refunded"]),
+        }
+        for row in rows
+    ]
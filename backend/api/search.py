@@ -0,0 +1,129 @@
+"""
+Full-text search over courses, curricula and lessons.
+
+The index is the ``api_search_index`` SQLite FTS5 table created by
+migration 0025 and kept up to date by triggers on the api_course,
+api_curriculum and api_lesson tables. Each document's rowid is
+``object id * 4 + kind`` so the triggers can update it by rowid.
+"""
+import re
+
+from django.db import connection
+from django.utils.html import escape
+
+SEARCH_TABLE = "api_search_index"
+
+COURSE = 1
+CURRICULUM = 2
+LESSON = 3
+
+KINDS = {COURSE: "course", CURRICULUM: "curriculum", LESSON: "lesson"}
+KIND_CODES = {name: code for code, name in KINDS.items()}
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+MAX_LIMIT = 50
+
+# Highlight delimiters, swapped for <mark> tags once the text is escaped
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+
+def search_available():
+    return connection.vendor == "sqlite"
+
+
+def mark(text):
+    return (
+        escape(text).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+    )
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match and the last
+    one is matched as a prefix, so results follow the user as they type.
+    Quoting every token keeps FTS5 operators in the input from being
+    interpreted.
+    """
+    tokens = TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search(
+    text,
+    kind=None,
+    category=None,
+    difficulty=None,
+    course_ids=None,
+    entitled_course_ids=frozenset(),
+    limit=20,
+):
+    """
+    Return up to ``limit`` hits ranked by BM25 (title weighted over body).
+
+    ``course_ids`` restricts hits to those courses. Lesson snippets are only
+    returned for courses in ``entitled_course_ids``.
+    """
+    match = build_match_query(text)
+    if match is None:
+        return []
+
+    joins = ""
+    where = [f"{SEARCH_TABLE} MATCH %s"]
+    params = [MARK_START, MARK_END, MARK_START, MARK_END, match]
+    if kind is not None:
+        where.append(f"{SEARCH_TABLE}.rowid %% 4 = %s")
+        params.append(KIND_CODES[kind])
+    if category or difficulty:
+        joins = f"JOIN api_course ON api_course.id = {SEARCH_TABLE}.course_id"
+        if category:
+            where.append("api_course.category = %s")
+            params.append(category)
+        if difficulty:
+            where.append("api_course.difficulty = %s")
+            params.append(difficulty)
+    if course_ids is not None:
+        if not course_ids:
+            return []
+        where.append(
+            f"{SEARCH_TABLE}.course_id IN ({', '.join(['%s'] * len(course_ids))})"
+        )
+        params.extend(course_ids)
+
+    sql = f"""
+        SELECT {SEARCH_TABLE}.rowid, {SEARCH_TABLE}.course_id,
+               highlight({SEARCH_TABLE}, 0, %s, %s),
+               snippet({SEARCH_TABLE}, 1, %s, %s, '…', 16),
+               rank
+        FROM {SEARCH_TABLE} {joins}
+        WHERE {' AND '.join(where)}
+        ORDER BY rank
+        LIMIT %s
+    """
+    params.append(min(limit, MAX_LIMIT))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    results = []
+    for rowid, course_id, title, snippet, rank in rows:
+        kind_code = rowid % 4
+        if kind_code == LESSON and course_id not in entitled_course_ids:
+            # Don't leak lesson content to students who aren't enrolled
+            snippet = None
+        results.append(
+            {
+                "type": KINDS[kind_code],
+                "id": rowid // 4,
+                "course_id": course_id,
+                "title": mark(title),
+                "snippet": mark(snippet) if snippet is not None else None,
+                "score": -rank,
+            }
+        )
+    return results
@@ -4,6 +4,7 @@ from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from rest_framework.request import Request
 from rest_framework.response import Response
 from django.conf import settings
@@ -12,7 +13,11 @@ from . import views
 from django.template.loader import render_to_string
 from django.db import transaction
 from django.db.models import F
+from django.urls import reverse
 from asgiref.sync import sync_to_async
+from .images import IMAGE_VERSION_LENGTH
+from .manager import SUBSCRIPTION_ACTIVE, SUBSCRIPTION_EXPIRED, SUBSCRIPTION_NONE
+from .tokens import EntitlementRefreshToken
 from .models import (
     ContactMessage,
     CustomUser,
@@ -22,6 +27,7 @@ from .models import (
     Curriculum,
     Lesson,
     ContactMessage,
+    PaymentEvent,
 )
 import environ
 import base64
@@ -37,6 +43,8 @@ MIN_LENGTH = 8
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = EntitlementRefreshToken
+
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
@@ -63,6 +71,11 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         return response
 
 
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    # Recomputes the entitlement claims of the new access token
+    token_class = EntitlementRefreshToken
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(min_length=MIN_LENGTH)
     user_type = serializers.ChoiceField(choices=CustomUser.USER_TYPE_CHOICES, default=1)
@@ -177,11 +190,59 @@ class CurriculumSerializer(serializers.ModelSerializer):
         )
 
 
-class CourseSerializer(serializers.ModelSerializer):
-    instructor_name = (
-        serializers.SerializerMethodField()
-    ) # Add a new field for instructor name
-    
+class CourseCardSerializer(serializers.ModelSerializer):
+    """Lightweight course representation for catalog listings.
+
+    Leaves out the nested curriculums/lessons and the binary image columns,
+    so it can be fed from a queryset that defers them.
+    """
+
+    instructor_name = serializers.SerializerMethodField()
+    image_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Course
+        fields = (
+            "id",
+            "title",
+            "description",
+            "publication_date",
+            "revision_date",
+            "category",
+            "duration",
+            "difficulty",
+            "instructor",
+            "instructor_name",
+            "image_url",
+            "image1",
+            "image2",
+            "image3",
+        )
+
+    def get_instructor_name(self, obj):
+        # instructor__user is select_related by CourseViewSet.get_queryset
+        user = obj.instructor.user
+        return user.first_name + " " + user.last_name
+
+    def get_image_url(self, obj):
+        # Versioned by the stored hash so the image can be cached forever
+        if not obj.image_hash:
+            return None
+        url = reverse("course_image", args=[obj.pk]) + "?v=" + obj.image_hash[:IMAGE_VERSION_LENGTH]
+        request = self.context.get("request")
+        if request:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class CourseSerializer(CourseCardSerializer):
+    """
+    Full course tree. Pass ``image_format="url"`` in the serializer context
+    to emit only ``image_url`` instead of the inline image_blob/image_base64.
+    """
+
+    IMAGE_FORMAT_URL = "url"
+
     image_base64 = serializers.SerializerMethodField()
     # image1 = (
     #     serializers.SerializerMethodField()
@@ -212,6 +273,7 @@ class CourseSerializer(serializers.ModelSerializer):
             "instructor_name",
             "image_blob",
             "image_base64",
+            "image_url",
             "image1",
             "image2",
             "image3",
@@ -224,27 +286,20 @@ class CourseSerializer(serializers.ModelSerializer):
     #         return request.build_absolute_uri(obj.image1.url)
     #     return obj.image1.url
     
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get("image_format") == self.IMAGE_FORMAT_URL:
+            # The blob columns are deferred in this mode, never read them
+            fields.pop("image_blob")
+            fields.pop("image_base64")
+        return fields
+
     def get_image_base64(self, obj):
-        if obj.image_blob: 
-            return base64.b64encode(obj.image_blob).decode('utf-8')
+        data = obj.read_image()
+        if data: 
+            return base64.b64encode(data).decode('utf-8')
         return None
-    
-    # def get_image_url(self, obj):
-    #     request = self.context.get('request')
-    #     return request.build_absolute_uri(obj.get_image_url())
 
-    # def get_image_url(self):
-    #     return reverse('course_image', args=[self.id])
-
-    def get_instructor_name(self, obj):
-        user = obj.instructor.user
-        # print(user)
-        return (
-            obj.instructor.user.first_name + " " + obj.instructor.user.last_name
-            if obj.instructor
-            else None
-        )  # Return instructor name if available, otherwise None
-        
     def create(self, validated_data):
         image_data = validated_data.pop('image_base64', None)
         if image_data:
@@ -260,6 +315,7 @@ class CourseSerializer(serializers.ModelSerializer):
 
 class ProfileSerializer(serializers.ModelSerializer):
     paid = serializers.BooleanField(source="student.paid")
+    subscription_state = serializers.SerializerMethodField()
 
     class Meta:
         model = CustomUser
@@ -272,14 +328,31 @@ class ProfileSerializer(serializers.ModelSerializer):
             "last_name",
             "user_type",
             "paid",
+            "subscription_state",
             "student",  # Include the related Student model
         )
 
+    def get_subscription_state(self, obj):
+        # Annotated by ProfileViewSet, worked out here for other callers
+        if hasattr(obj, "subscription_state"):
+            return obj.subscription_state
+        student = getattr(obj, "student", None)
+        if student is None or not student.paid or student.subscription_end is None:
+            return SUBSCRIPTION_NONE
+        if student.has_active_subscription:
+            return SUBSCRIPTION_ACTIVE
+        return SUBSCRIPTION_EXPIRED
+
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         if hasattr(instance, "student"):  # Check if the instance has a student profile
+            courses = instance.student.courses_enlisted.select_related(
+                "instructor__user"
+            ).prefetch_related("curriculums__lessons")
+            if self.context.get("image_format") == CourseSerializer.IMAGE_FORMAT_URL:
+                courses = courses.defer("image", "image_blob")
             representation["courses_enlisted"] = CourseSerializer(
-                instance.student.courses_enlisted, many=True
+                courses, many=True, context=self.context
             ).data
         else:
             representation["courses_enlisted"] = (
@@ -316,3 +389,18 @@ class ContactMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ContactMessage
         fields = "__all__"
+
+
+class PaymentEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaymentEvent
+        fields = (
+            "id",
+            "payment_status",
+            "applied",
+            "pay_amount",
+            "pay_currency",
+            "price_amount",
+            "price_currency",
+            "received_at",
+        )
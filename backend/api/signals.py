@@ -0,0 +1,77 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from .blacklist import token_blacklisted
+from .cache import bump_catalog_version
+from .entitlements import invalidate_entitlements
+from .models import Course, Curriculum, CustomUser, Instructor, Lesson, Student
+from .usercache import bump_user_versions
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Curriculum)
+@receiver(post_delete, sender=Curriculum)
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=CustomUser)
+def instructor_changed(sender, instance, **kwargs):
+    # Course payloads embed the instructor's name. user_type is a CharField,
+    # it's only an int on instances that haven't been loaded from the DB
+    if str(instance.user_type) == str(CustomUser.INSTRUCTOR):
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def student_changed(sender, instance, **kwargs):
+    # Subscription changes are UPDATEs, Student.subscription_changed() covers them
+    invalidate_entitlements(instance.user_id)
+
+
+# Authenticated users are cached along with their profile (api.usercache)
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    bump_user_versions(instance.pk)
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+@receiver(post_save, sender=Instructor)
+@receiver(post_delete, sender=Instructor)
+def profile_changed(sender, instance, **kwargs):
+    bump_user_versions(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Student.courses_enlisted.through)
+def enrollments_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_entitlements(instance.user_id)
+        return
+
+    # course.student_set.add/remove/clear(): pk_set holds student ids
+    if action == "pre_clear":
+        instance._enrolled_user_ids = list(
+            Student.objects.filter(courses_enlisted=instance).values_list(
+                "user_id", flat=True
+            )
+        )
+    elif action == "post_clear":
+        invalidate_entitlements(*getattr(instance, "_enrolled_user_ids", ()))
+    elif action in ("post_add", "post_remove") and pk_set:
+        invalidate_entitlements(
+            *Student.objects.filter(pk__in=pk_set).values_list("user_id", flat=True)
+        )
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def token_blacklisted_changed(sender, instance, created, **kwargs):
+    if created:
+        token_blacklisted(instance.token.jti)
@@ -0,0 +1,65 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+from .images import sniff_content_type
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names every file after the sha256 of its
+    content, so identical uploads are stored only once.
+
+    The name passed to save() is ignored apart from its extension; the
+    stored name is ``<hash[:2]>/<hash><ext>``.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Same name means same content, never rename
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content_hash = digest.hexdigest()
+
+        extension = os.path.splitext(name)[1]
+        if not extension:
+            content.seek(0)
+            content_type = sniff_content_type(content.read(16))
+            extension = mimetypes.guess_extension(content_type) or ""
+        name = f"{content_hash[:2]}/{content_hash}{extension}"
+        if self.exists(name):
+            return name
+
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and rename so that concurrent writers of
+        # the same content never expose a partial file
+        content.seek(0)
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp:
+            for chunk in content.chunks():
+                tmp.write(chunk)
+        if self.file_permissions_mode is not None:
+            os.chmod(tmp.name, self.file_permissions_mode)
+        os.replace(tmp.name, full_path)
+        return name
+
+
+def content_hash_from_name(name):
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def course_image_storage():
+    return ContentAddressedStorage(
+        location=settings.COURSE_IMAGE_ROOT,
+        base_url=settings.MEDIA_URL + "course_images/",
+    )
@@ -1,3 +1,1672 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from .models import (
+    Course,
+    Curriculum,
+    CustomUser,
+    IPNMessage,
+    Instructor,
+    Lesson,
+    Payment,
+    PaymentEvent,
+    RevenueRollup,
+    Student,
+)
+from . import search
+from .autocomplete import PrefixIndex
+from .blacklist import TokenBlacklist
+from .cache import catalog_cache_stats, catalog_version
+from .entitlements import (
+    decode_course_ids,
+    encode_course_ids,
+    entitlements_key,
+    get_entitlements,
+)
+from .images import content_hash
+from .payments import process_inbox, transition
+from .permissions import IsPaidStudent
+from .usercache import get_cached_user, local_users, user_key, user_version
+from .views import ProfileViewSet
+
+
+def make_instructor(email="instructor@example.com"):
+    user = CustomUser.objects.create_user(
+        email,
+        "password",
+        email.split("@")[0],
+        user_type=CustomUser.INSTRUCTOR,
+        first_name="Ada",
+        last_name="Lovelace",
+    )
+    return Instructor.objects.create(user=user)
+
+
+def make_course(instructor, title="Web security", category="FREE", **kwargs):
+    return Course.objects.create(
+        title=title,
+        description="Course description",
+        category=category,
+        duration="1h",
+        difficulty="BEGINNER",
+        instructor=instructor,
+        image1="post_images/1.png",
+        image2="post_images/2.png",
+        image3="post_images/3.png",
+        **kwargs,
+    )
+
+
+def make_curriculum(course, title="Basics"):
+    return Curriculum.objects.create(
+        title=title,
+        description="Curriculum description",
+        duration="1h",
+        difficulty="BEGINNER",
+        course=course,
+    )
+
+
+def make_lesson(curriculum, sequence_number=1, title="Lesson"):
+    return Lesson.objects.create(
+        title=title,
+        sequence_number=sequence_number,
+        content="Lesson content",
+        duration="10m",
+        curriculum=curriculum,
+    )
+
+
+def make_student(email="student@example.com", paid=False):
+    user = CustomUser.objects.create_user(
+        email, "password", email.split("@")[0], user_type=CustomUser.STUDENT
+    )
+    Student.objects.create(user=user, paid=paid)
+    return user
+
+
+def make_payment(user, payment_id="1001", price_amount="10.00", **kwargs):
+    return Payment.objects.create(
+        student=user.student,
+        payment_id=payment_id,
+        subscription_type="monthly",
+        duration_months=1,
+        price_amount=price_amount,
+        price_currency="USD",
+        payment_status="waiting",
+        **kwargs,
+    )
+
+
+def make_ipn_message(payment_id, payment_status, received_at=None, **data):
+    payload = {"payment_id": payment_id, "payment_status": payment_status, **data}
+    message = IPNMessage.objects.create(
+        payment_id=payment_id,
+        payment_status=payment_status,
+        payload=json.dumps(payload, sort_keys=True),
+    )
+    if received_at is not None:
+        # received_at is auto_now_add
+        IPNMessage.objects.filter(pk=message.pk).update(received_at=received_at)
+    return message
+
+
+def make_png(width=64, height=32, color="red"):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(output, "PNG")
+    return output.getvalue()
+
+
+class BaseTestCase(APITestCase):
+    def setUp(self):
+        # Catalog, entitlement and user caches outlive the test transaction
+        cache.clear()
+        local_users.clear()
+
+
+class MediaTestCase(BaseTestCase):
+    """Runs with the media, course image and variant directories in a temp dir."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_VARIANT_CACHE_DIR=os.path.join(self.media_root, "variants"),
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+        for patcher in (
+            mock.patch.object(
+                Course._meta.get_field("image_file").storage,
+                "location",
+                os.path.join(self.media_root, "course_images"),
+            ),
+            mock.patch("api.variants._cache", None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_media(self, name, data):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+class KeysetPaginationTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.courses = [
+            make_course(instructor, title=f"Course {i}") for i in range(5)
+        ]
+
+    def cursor(self, direction, values):
+        return base64.urlsafe_b64encode(
+            json.dumps({"d": direction, "v": values}).encode()
+        ).decode()
+
+    def test_pages_follow_next_links(self):
+        ids = []
+        url = "/api/course/?mode=card&page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [course["id"] for course in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, [course.pk for course in self.courses])
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get("/api/course/?mode=card&page_size=2")
+        second = self.client.get(first.data["next"])
+        previous = self.client.get(second.data["previous"])
+        self.assertEqual(previous.data["results"], first.data["results"])
+
+    def test_malformed_cursor_is_not_found(self):
+        for cursor in (
+            "not base64!",
+            self.cursor("x", ["2024-01-01T00:00:00+00:00", 1]),
+            self.cursor("n", [1]),
+            self.cursor("n", ["garbage", 1]),
+            self.cursor("n", [{}, 1]),
+            self.cursor("n", [None, 1]),
+            self.cursor("n", ["2024-01-01T00:00:00+00:00", "one"]),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f"/api/course/?mode=card&cursor={cursor}")
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data["detail"], "Invalid cursor.")
+
+
+class RevenueRollupTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        user = make_student()
+        make_payment(user, "finished-then-refunded", "10.00")
+        make_payment(user, "partial-refund", "25.00")
+        make_payment(user, "still-waiting", "99.00")
+        monday = datetime(2024, 1, 1, 12, tzinfo=dt_timezone.utc)
+        tuesday = datetime(2024, 1, 2, 12, tzinfo=dt_timezone.utc)
+        make_ipn_message("finished-then-refunded", "finished", monday)
+        make_ipn_message("finished-then-refunded", "refunded", tuesday)
+        make_ipn_message("partial-refund", "partially_paid", monday)
+        make_ipn_message("partial-refund", "refunded", tuesday)
+        make_ipn_message("still-waiting", "confirming", monday)
+        process_inbox()
+
+    def rollups(self):
+        return list(
+            RevenueRollup.objects.order_by("day").values_list(
+                "day", "currency", "payments", "revenue", "refunds", "refunded"
+            )
+        )
+
+    def test_rollups_are_dated_by_callback_receipt(self):
+        self.assertEqual(
+            self.rollups(),
+            [
+                (datetime(2024, 1, 1).date(), "usd", 1, Decimal("10.00"), 0, 0),
+                (datetime(2024, 1, 2).date(), "usd", 0, 0, 1, Decimal("10.00")),
+            ],
+        )
+
+    def test_refund_of_unfinished_payment_is_not_booked(self):
+        self.assertEqual(
+            Payment.objects.get(payment_id="partial-refund").payment_status, "refunded"
+        )
+        self.assertTrue(
+            PaymentEvent.objects.get(
+                payment_id="partial-refund", payment_status="refunded"
+            ).applied
+        )
+        self.assertEqual(sum(row[4] for row in self.rollups()), 1)
+
+    def test_backfill_rebuilds_the_live_rollups(self):
+        live = self.rollups()
+        call_command("backfill_revenue_rollups", sleep=0, stdout=StringIO())
+        self.assertEqual(self.rollups(), live)
+
+    def test_report_sums_buckets(self):
+        admin = CustomUser.objects.create_superuser(
+            "admin@example.com", "password", "admin"
+        )
+        self.client.force_authenticate(admin)
+        response = self.client.get(
+            "/api/reports/revenue/?bucket=month&start=2024-01-01&end=2024-01-31"
+        )
+        self.assertEqual(response.status_code, 200)
+        [row] = response.data["results"]
+        self.assertEqual(row["payments"], 1)
+        self.assertEqual(row["revenue"], "10.00")
+        self.assertEqual(row["refunds"], 1)
+        self.assertEqual(row["refunded"], "10.00")
+        self.assertEqual(row["net"], "0.00")
+
+
+class TokenBlacklistTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_student()
+
+    def outstanding(self, jti, **kwargs):
+        return OutstandingToken.objects.create(
+            user=self.user,
+            jti=jti,
+            token=jti,
+            expires_at=aware_utcnow() + timedelta(days=1),
+            **kwargs,
+        )
+
+    def blacklist_elsewhere(self, token, blacklisted_at=None, **kwargs):
+        # bulk_create sends no signal, like a write from another process
+        [row] = BlacklistedToken.objects.bulk_create(
+            [BlacklistedToken(token=token, **kwargs)]
+        )
+        if blacklisted_at is not None:
+            BlacklistedToken.objects.filter(pk=row.pk).update(
+                blacklisted_at=blacklisted_at
+            )
+
+    def test_logged_out_refresh_token_is_rejected(self):
+        response = self.client.post(
+            "/api/token/", {"email": "student@example.com", "password": "password"}
+        )
+        refresh = response.data["refresh"]
+        self.assertEqual(
+            self.client.post("/api/token/refresh/", {"refresh": refresh}).status_code,
+            200,
+        )
+        self.client.post("/api/logout/", {"refresh_token": refresh})
+        self.assertEqual(
+            self.client.post("/api/token/refresh/", {"refresh": refresh}).status_code,
+            401,
+        )
+
+    def test_without_shared_cache_checks_the_database(self):
+        token = self.outstanding("elsewhere")
+        blacklist = TokenBlacklist(1000, 0.01, sync_interval=3600)
+        self.assertFalse(blacklist.is_blacklisted("elsewhere"))
+        self.blacklist_elsewhere(token)
+        self.assertTrue(blacklist.is_blacklisted("elsewhere"))
+
+    @mock.patch("api.blacklist.shared_cache_configured", return_value=True)
+    def test_sync_reads_rows_committed_out_of_order(self, shared_cache_configured):
+        now = aware_utcnow()
+        blacklist = TokenBlacklist(1000, 0.01, sync_interval=0)
+        self.blacklist_elsewhere(self.outstanding("newer"), now, id=10)
+        self.assertTrue(blacklist.is_blacklisted("newer"))
+        # Lower id and an older timestamp, committed after the sync above
+        self.blacklist_elsewhere(
+            self.outstanding("older"), now - timedelta(seconds=5), id=5
+        )
+        self.assertTrue(blacklist.is_blacklisted("older"))
+        self.assertEqual(blacklist.count, 2)
+
+    @mock.patch("api.blacklist.shared_cache_configured", return_value=True)
+    def test_filter_grows_past_the_configured_capacity(self, shared_cache_configured):
+        for i in range(5):
+            self.blacklist_elsewhere(self.outstanding(f"jti-{i}"))
+        blacklist = TokenBlacklist(2, 0.01, sync_interval=3600)
+        self.assertFalse(blacklist.is_blacklisted("unknown"))
+        self.assertEqual(blacklist.count, 5)
+        self.assertGreaterEqual(blacklist.bloom_capacity, 10)
+        # No rebuild, and no rescan of the table, while the rows fit
+        with self.assertNumQueries(0):
+            self.assertFalse(blacklist.is_blacklisted("unknown"))
+
+
+class IPNInboxTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_student()
+
+    def test_finished_payment_renews_subscription(self):
+        make_payment(self.user, "1001")
+        message = make_ipn_message("1001", "finished")
+        self.assertEqual(process_inbox(), 1)
+
+        message.refresh_from_db()
+        self.assertIsNotNone(message.processed_at)
+        self.assertEqual(Payment.objects.get().payment_status, "finished")
+        self.user.student.refresh_from_db()
+        self.assertTrue(self.user.student.has_active_subscription)
+
+    def test_failed_message_is_retried_after_backoff(self):
+        # Callback for a payment SaveInvoiceView hasn't stored yet
+        message = make_ipn_message("1001", "finished")
+        with self.assertLogs("api.payments", "ERROR"):
+            process_inbox(base_delay=60)
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+        self.assertIsNone(message.processed_at)
+        self.assertIn("not found", message.error)
+
+        # Not picked up again until the backoff has passed
+        self.assertEqual(process_inbox(base_delay=60), 0)
+        make_payment(self.user, "1001")
+        later = message.next_attempt_at + timedelta(seconds=1)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.assertEqual(process_inbox(base_delay=60), 1)
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 2)
+        self.assertIsNotNone(message.processed_at)
+
+    def test_backoff_doubles_with_each_failure(self):
+        message = make_ipn_message("1001", "finished")
+        delays = []
+        for _ in range(3):
+            now = IPNMessage.objects.get().next_attempt_at
+            with mock.patch("django.utils.timezone.now", return_value=now):
+                with self.assertLogs("api.payments", "ERROR"):
+                    process_inbox(base_delay=60)
+            message.refresh_from_db()
+            delays.append((message.next_attempt_at - now).total_seconds())
+        self.assertEqual(delays, [60, 120, 240])
+
+
+class PaymentEventTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        make_payment(make_student(), "1001")
+
+    def test_every_callback_is_logged(self):
+        make_ipn_message("1001", "confirming", pay_amount="0.00123", pay_currency="btc")
+        make_ipn_message("1001", "finished")
+        make_ipn_message("1001", "waiting")
+        process_inbox()
+        self.assertEqual(
+            list(
+                PaymentEvent.objects.order_by("id").values_list(
+                    "payment_status", "applied"
+                )
+            ),
+            [("confirming", True), ("finished", True), ("waiting", False)],
+        )
+        event = PaymentEvent.objects.get(payment_status="confirming")
+        self.assertEqual(event.pay_amount, Decimal("0.00123"))
+        self.assertEqual(event.pay_currency, "btc")
+
+    def test_out_of_range_amounts_are_dropped(self):
+        message = make_ipn_message(
+            "1001", "finished", pay_amount="1e40", price_amount="NaN"
+        )
+        process_inbox()
+        message.refresh_from_db()
+        self.assertIsNotNone(message.processed_at)
+        event = PaymentEvent.objects.get()
+        self.assertIsNone(event.pay_amount)
+        self.assertIsNone(event.price_amount)
+
+    def test_message_and_event_are_saved_together(self):
+        message = make_ipn_message("1001", "finished")
+        with mock.patch.object(PaymentEvent, "save", side_effect=RuntimeError):
+            with self.assertLogs("api.payments", "ERROR"):
+                process_inbox()
+        message.refresh_from_db()
+        self.assertIsNone(message.processed_at)
+        self.assertEqual(Payment.objects.get().payment_status, "waiting")
+
+    def test_history_is_paginated_for_admins(self):
+        for payment_status in ("confirming", "confirmed", "finished"):
+            make_ipn_message("1001", payment_status)
+        process_inbox()
+        url = "/api/payments/1001/events/?page_size=2"
+        self.client.force_authenticate(make_student("other@example.com"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        admin = CustomUser.objects.create_superuser(
+            "admin@example.com", "password", "admin"
+        )
+        self.client.force_authenticate(admin)
+        first = self.client.get(url)
+        second = self.client.get(first.data["next"])
+        self.assertEqual(
+            [event["payment_status"] for event in first.data["results"]],
+            ["confirming", "confirmed"],
+        )
+        self.assertEqual(
+            [event["payment_status"] for event in second.data["results"]],
+            ["finished"],
+        )
+        self.assertIsNone(second.data["next"])
+
+
+class UserCacheTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_student()
+
+    def test_each_lookup_gets_its_own_instance(self):
+        first = get_cached_user(self.user.pk)
+        second = get_cached_user(self.user.pk)
+        self.assertIsNot(first, second)
+        self.assertIsNot(first.student, second.student)
+        first.first_name = "Changed"
+        first.student.paid = True
+        third = get_cached_user(self.user.pk)
+        self.assertEqual(third.first_name, "")
+        self.assertFalse(third.student.paid)
+
+    def test_profiles_are_served_without_queries(self):
+        get_cached_user(self.user.pk)
+        with self.assertNumQueries(0):
+            user = get_cached_user(self.user.pk)
+            self.assertEqual(user.student.user_id, self.user.pk)
+            self.assertFalse(hasattr(user, "instructor"))
+
+    def test_password_hash_is_not_cached(self):
+        get_cached_user(self.user.pk)
+        snapshot = cache.get(user_key(self.user.pk, user_version(self.user.pk)))
+        self.assertNotIn(self.user.password.encode(), pickle.dumps(snapshot))
+        # Still there when asked for
+        user = get_cached_user(self.user.pk)
+        self.assertTrue(user.check_password("password"))
+
+    def test_saving_the_user_expires_the_cached_copy(self):
+        get_cached_user(self.user.pk)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(get_cached_user(self.user.pk).is_active)
+
+
+class CatalogCacheTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.instructor = make_instructor()
+        self.course = make_course(self.instructor)
+
+    def test_cached_list_is_served_until_the_catalog_changes(self):
+        self.client.get("/api/course/?mode=card")
+        self.assertEqual(catalog_cache_stats()["hits"], 0)
+        self.client.get("/api/course/?mode=card")
+        self.assertEqual(catalog_cache_stats()["hits"], 1)
+
+        make_course(self.instructor, title="Second course")
+        response = self.client.get("/api/course/?mode=card")
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_deleting_a_course_invalidates_the_cache(self):
+        self.client.get("/api/course/?mode=card")
+        self.course.delete()
+        self.assertEqual(self.client.get("/api/course/?mode=card").data["results"], [])
+
+    def test_renaming_an_instructor_bumps_the_catalog_version(self):
+        response = self.client.get("/api/course/?mode=card")
+        self.assertEqual(response.data["results"][0]["instructor_name"], "Ada Lovelace")
+        version = catalog_version()
+
+        user = CustomUser.objects.get(pk=self.instructor.user_id)
+        user.last_name = "Byron"
+        user.save()
+        self.assertNotEqual(catalog_version(), version)
+        response = self.client.get("/api/course/?mode=card")
+        self.assertEqual(response.data["results"][0]["instructor_name"], "Ada Byron")
+
+    def test_saving_a_student_keeps_the_catalog_version(self):
+        user = CustomUser.objects.get(pk=make_student().pk)
+        version = catalog_version()
+        user.save()
+        self.assertEqual(catalog_version(), version)
+
+
+class ImageVariantTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = make_course(make_instructor(), image_blob=make_png(640, 320))
+        self.write_media("post_images/1.png", make_png(64, 32))
+
+    def url(self, slot, query="w=160&format=webp"):
+        return f"/api/course/{self.course.pk}/images/{slot}/?{query}"
+
+    def test_variant_is_resized_and_revalidated(self):
+        response = self.client.get(self.url("image"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        with Image.open(io.BytesIO(b"".join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (160, 80))
+
+        response = self.client.get(
+            self.url("image"), HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_replacing_a_file_under_the_same_name_changes_the_variant(self):
+        first = self.client.get(self.url("image1"))
+        self.assertEqual(first.status_code, 200)
+        self.write_media("post_images/1.png", make_png(48, 48, "blue"))
+        second = self.client.get(self.url("image1"))
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        with Image.open(io.BytesIO(b"".join(second.streaming_content))) as image:
+            self.assertEqual(image.size, (48, 48))
+
+    def test_missing_source_is_not_found(self):
+        self.assertEqual(self.client.get(self.url("image2")).status_code, 404)
+        self.assertEqual(self.client.get(self.url("poster")).status_code, 404)
+
+    def test_undecodable_sources_are_unsupported(self):
+        self.write_media("post_images/2.png", make_png(64, 32)[:60])
+        self.write_media("post_images/3.png", b"not an image")
+        with self.assertLogs("api.views", "WARNING"):
+            self.assertEqual(self.client.get(self.url("image2")).status_code, 415)
+            self.assertEqual(self.client.get(self.url("image3")).status_code, 415)
+
+    def test_decompression_bomb_is_unsupported(self):
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 100):
+            with self.assertLogs("api.views", "WARNING"):
+                response = self.client.get(self.url("image1"))
+        self.assertEqual(response.status_code, 415)
+
+    def test_bad_parameters_are_rejected(self):
+        self.assertEqual(self.client.get(self.url("image", "w=wide")).status_code, 400)
+        self.assertEqual(
+            self.client.get(self.url("image", "format=tiff")).status_code, 400
+        )
+
+
+@mock.patch("api.ipn.IPN_KEY", b"ipn-secret")
+class IPNCallbackTests(BaseTestCase):
+    def post(self, body, signature=None, **extra):
+        if signature is None:
+            signature = hmac.new(b"ipn-secret", body, hashlib.sha512).hexdigest()
+        return self.client.generic(
+            "POST",
+            "/api/ipn/",
+            body,
+            content_type="application/json",
+            HTTP_X_NOWPAYMENTS_SIG=signature,
+            **extra,
+        )
+
+    def payload(self, **data):
+        return json.dumps(
+            {"payment_id": 1001, "payment_status": "finished", **data},
+            separators=(",", ":"),
+            sort_keys=True,
+        ).encode()
+
+    def test_signed_callback_is_queued_once(self):
+        body = self.payload()
+        self.assertEqual(self.post(body).status_code, 200)
+        # NOWPayments retries until it gets a 200
+        self.assertEqual(self.post(body).status_code, 200)
+        message = IPNMessage.objects.get()
+        self.assertEqual((message.payment_id, message.payment_status), ("1001", "finished"))
+        self.assertEqual(message.payload, body.decode())
+
+    def test_unsorted_body_is_verified_in_canonical_form(self):
+        body = json.dumps({"payment_status": "finished", "payment_id": 1001}).encode()
+        canonical = self.payload()
+        signature = hmac.new(b"ipn-secret", canonical, hashlib.sha512).hexdigest()
+        self.assertEqual(self.post(body, signature).status_code, 200)
+        self.assertEqual(IPNMessage.objects.get().payload, canonical.decode())
+
+    def test_bad_signatures_are_rejected(self):
+        body = self.payload()
+        with self.assertLogs("api.views", "WARNING"):
+            self.assertEqual(self.post(body, "").status_code, 400)
+            self.assertEqual(self.post(body, "0" * 128).status_code, 400)
+            self.assertEqual(self.post(body, "abc").status_code, 400)
+        self.assertFalse(IPNMessage.objects.exists())
+
+    def test_oversized_body_is_rejected_unread(self):
+        body = self.payload(padding="x" * 70000)
+        with mock.patch("api.ipn.verify") as verify:
+            with self.assertLogs("api.views", "WARNING"):
+                response = self.post(body)
+        self.assertEqual(response.status_code, 413)
+        verify.assert_not_called()
+
+
+class SharedCacheTestCase(BaseTestCase):
+    """Runs with a cache every process shares, file based in a temp dir."""
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        shared = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": cache_dir,
+                }
+            }
+        )
+        shared.enable()
+        self.addCleanup(shared.disable)
+        super().setUp()
+
+
+class ConditionalGetTests(SharedCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.instructor = make_instructor()
+        self.course = make_course(self.instructor)
+        self.lesson = make_lesson(make_curriculum(self.course))
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_unchanged_list_is_not_modified_without_queries(self):
+        url = "/api/course/?mode=card"
+        response = self.client.get(url)
+        self.assertNotIn("Last-Modified", response)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+    def test_delete_changes_the_etag(self):
+        url = "/api/course/?mode=card"
+        response = self.client.get(url)
+        make_course(self.instructor, title="Second course").delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_instructor_rename_changes_the_etag(self):
+        url = f"/api/course/{self.course.pk}/?image=url"
+        response = self.client.get(url)
+        user = CustomUser.objects.get(pk=self.instructor.user_id)
+        user.first_name = "Augusta"
+        user.save()
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["instructor_name"], "Augusta Lovelace")
+
+    def test_enrollment_changes_the_lesson_list_etag(self):
+        user = make_student()
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/lesson/")
+        self.assertEqual(response.data["results"], [])
+        user.student.courses_enlisted.add(self.course)
+        response = self.revalidate("/api/lesson/", response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_lesson_retrieve_is_revalidated(self):
+        user = make_student()
+        user.student.courses_enlisted.add(self.course)
+        self.client.force_authenticate(user)
+        url = f"/api/lesson/{self.lesson.pk}/"
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        self.lesson.title = "Renamed"
+        self.lesson.save()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class ConditionalGetFallbackTests(BaseTestCase):
+    """ETags without a shared cache, from one aggregate over the rows."""
+
+    def setUp(self):
+        super().setUp()
+        self.instructor = make_instructor()
+        self.course = make_course(self.instructor)
+        self.lesson = make_lesson(make_curriculum(self.course))
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_unchanged_list_is_not_modified_after_one_query(self):
+        url = "/api/course/?mode=card"
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+    def test_catalog_version_is_not_used(self):
+        url = "/api/course/?mode=card"
+        response = self.client.get(url)
+        # Another process's write never reaches this process's version
+        with mock.patch("api.conditional.catalog_version", return_value=0):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+    def test_revision_changes_the_etag(self):
+        url = f"/api/course/{self.course.pk}/?image=url"
+        response = self.client.get(url)
+        Course.objects.filter(pk=self.course.pk).update(
+            revision_date=datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+        )
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_added_and_deleted_rows_change_the_etag(self):
+        url = "/api/course/?mode=card"
+        response = self.client.get(url)
+        course = make_course(self.instructor, title="Second course")
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        course.delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_lesson_changes_change_the_course_tree_etags(self):
+        urls = [f"/api/course/{self.course.pk}/?image=url", "/api/curriculum/"]
+        responses = [self.client.get(url) for url in urls]
+        Lesson.objects.filter(pk=self.lesson.pk).update(
+            last_updated=datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+        )
+        for url, response in zip(urls, responses):
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url, response).status_code, 200)
+        responses = [self.client.get(url) for url in urls]
+        self.lesson.delete()
+        for url, response in zip(urls, responses):
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_enrollment_changes_the_lesson_list_etag(self):
+        user = make_student()
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/lesson/")
+        user.student.courses_enlisted.add(self.course)
+        response = self.revalidate("/api/lesson/", response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_lesson_retrieve_needs_no_extra_query(self):
+        user = make_student()
+        user.student.courses_enlisted.add(self.course)
+        self.client.force_authenticate(user)
+        url = f"/api/lesson/{self.lesson.pk}/"
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+        Lesson.objects.filter(pk=self.lesson.pk).update(
+            last_updated=datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+        )
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class CatalogTimestampTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = make_course(make_instructor())
+        self.curriculum = make_curriculum(self.course)
+
+    def test_client_timestamps_are_kept(self):
+        revised = datetime(2024, 5, 1, tzinfo=dt_timezone.utc)
+        response = self.client.patch(
+            f"/api/course/{self.course.pk}/",
+            {"revision_date": revised.isoformat()},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.revision_date, revised)
+
+        lesson = make_lesson(self.curriculum)
+        self.assertIsNone(lesson.last_updated)
+
+    def test_curriculum_and_lesson_writes_leave_the_course_alone(self):
+        with CaptureQueriesContext(connection) as queries:
+            make_lesson(self.curriculum)
+            self.curriculum.save()
+            self.curriculum.delete()
+        self.assertFalse(
+            [q["sql"] for q in queries if q["sql"].startswith('UPDATE "api_course"')]
+        )
+
+
+class IsPaidStudentTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = make_course(make_instructor(), category="PAID")
+        self.lesson = make_lesson(make_curriculum(self.course))
+
+    def has_object_permission(self, user, lesson):
+        request = mock.Mock(user=user, auth=None)
+        return IsPaidStudent().has_object_permission(request, None, lesson)
+
+    def test_paid_course_needs_payment_and_enrollment(self):
+        user = make_student()
+        user.student.courses_enlisted.add(self.course)
+        self.assertFalse(self.has_object_permission(user, self.lesson))
+        Student.objects.filter(user=user).update(paid=True)
+        cache.clear()
+        self.assertTrue(self.has_object_permission(user, self.lesson))
+
+    def test_lesson_without_course_is_denied(self):
+        user = make_student(paid=True)
+        user.student.courses_enlisted.add(self.course)
+        Lesson.objects.filter(pk=self.lesson.pk).update(course=None)
+        lesson = Lesson.objects.get(pk=self.lesson.pk)
+        self.assertFalse(self.has_object_permission(user, lesson))
+
+
+class CourseListTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.instructor = make_instructor()
+        self.add_courses(2)
+
+    def add_courses(self, count):
+        for _ in range(count):
+            course = make_course(self.instructor)
+            make_lesson(make_curriculum(course))
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_card_mode_leaves_out_the_course_tree(self):
+        response = self.client.get("/api/course/?mode=card")
+        card = response.data["results"][0]
+        self.assertEqual(card["instructor_name"], "Ada Lovelace")
+        self.assertNotIn("curriculums", card)
+        self.assertNotIn("image_blob", card)
+        self.assertIn("curriculums", self.client.get("/api/course/").data["results"][0])
+
+    def test_queries_do_not_grow_with_the_number_of_courses(self):
+        urls = ("/api/course/?mode=card", "/api/course/", "/api/course/?image=url")
+        before = [self.count_queries(url) for url in urls]
+        self.add_courses(3)
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+
+
+class CourseImageTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.image = make_png()
+        self.course = make_course(make_instructor(), image_blob=self.image)
+        self.url = f"/api/course/{self.course.pk}/image/"
+
+    def body(self, response):
+        if response.streaming:
+            return b"".join(response.streaming_content)
+        return response.content
+
+    def test_image_is_served_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["ETag"], f'"{content_hash(self.image)}"')
+        self.assertEqual(self.body(response), self.image)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-3")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.image[:4])
+        self.assertEqual(response["Content-Range"], f"bytes 0-3/{len(self.image)}")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-4")
+        self.assertEqual(response.content, self.image[-4:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.image)}-")
+        self.assertEqual(response.status_code, 416)
+
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-3", HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.image)
+
+    def test_missing_image_and_unsafe_methods(self):
+        course = make_course(make_instructor("other@example.com"))
+        self.assertEqual(
+            self.client.get(f"/api/course/{course.pk}/image/").status_code, 404
+        )
+        self.assertEqual(self.client.get("/api/course/0/image/").status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+
+class CourseImageURLTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.image = make_png()
+        self.course = make_course(make_instructor(), image_blob=self.image)
+
+    def test_url_mode_emits_versioned_urls_only(self):
+        course = self.client.get("/api/course/?image=url").data["results"][0]
+        self.assertNotIn("image_base64", course)
+        self.assertNotIn("image_blob", course)
+        self.assertTrue(
+            course["image_url"].endswith(
+                f"/api/course/{self.course.pk}/image/?v={content_hash(self.image)[:16]}"
+            )
+        )
+        # The default mode still inlines the image
+        course = self.client.get("/api/course/").data["results"][0]
+        self.assertEqual(base64.b64decode(course["image_base64"]), self.image)
+
+    def test_versioned_url_is_immutable(self):
+        url = self.client.get("/api/course/?mode=card").data["results"][0]["image_url"]
+        self.assertIn("immutable", self.client.get(url)["Cache-Control"])
+        response = self.client.get(f"/api/course/{self.course.pk}/image/?v=old")
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+    def test_new_image_gets_a_new_url(self):
+        url = self.client.get("/api/course/?mode=card").data["results"][0]["image_url"]
+        self.course.image_blob = make_png(color="blue")
+        self.course.save()
+        new_url = self.client.get("/api/course/?mode=card").data["results"][0][
+            "image_url"
+        ]
+        self.assertNotEqual(new_url, url)
+
+    def test_profile_lists_enrolled_courses_with_urls(self):
+        user = make_student()
+        user.student.courses_enlisted.add(self.course)
+        self.client.force_authenticate(user)
+        [course] = self.client.get("/api/profile/?image=url").data["courses_enlisted"]
+        self.assertIn("image_url", course)
+        self.assertNotIn("image_base64", course)
+
+
+class CourseImageStorageTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.instructor = make_instructor()
+        self.image = make_png()
+        self.digest = content_hash(self.image)
+
+    def test_saved_image_moves_out_of_the_row(self):
+        course = make_course(self.instructor, image_blob=self.image)
+        course.refresh_from_db()
+        self.assertIsNone(course.image_blob)
+        self.assertEqual(course.image_file.name, f"{self.digest[:2]}/{self.digest}.png")
+        self.assertEqual(course.image_hash, self.digest)
+        self.assertEqual(course.read_image(), self.image)
+
+    def test_identical_images_are_stored_once(self):
+        first = make_course(self.instructor, image_blob=self.image)
+        second = make_course(self.instructor, image=self.image)
+        self.assertEqual(first.image_file.name, second.image_file.name)
+        directory = os.path.join(self.media_root, "course_images", self.digest[:2])
+        self.assertEqual(os.listdir(directory), [f"{self.digest}.png"])
+
+    def test_command_offloads_rows_written_in_place(self):
+        course = make_course(self.instructor)
+        # As left behind by the migrations, bypassing save()
+        Course.objects.filter(pk=course.pk).update(image_blob=self.image)
+        call_command("offload_course_images", stdout=StringIO())
+        course.refresh_from_db()
+        self.assertIsNone(course.image_blob)
+        self.assertEqual(course.image_hash, self.digest)
+        response = self.client.get(f"/api/course/{course.pk}/image/")
+        self.assertEqual(b"".join(response.streaming_content), self.image)
+
+
+class EntitlementCacheTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.courses = [make_course(instructor, title=f"Course {i}") for i in range(2)]
+        self.user = make_student()
+        self.student = self.user.student
+
+    def test_entitlements_are_cached(self):
+        self.student.courses_enlisted.add(self.courses[0])
+        entitlements = get_entitlements(self.user)
+        self.assertEqual(entitlements.course_ids, {self.courses[0].pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_entitlements(self.user), entitlements)
+
+    def test_enrollment_changes_from_either_side_invalidate(self):
+        course = self.courses[1]
+        get_entitlements(self.user)
+        course.student_set.add(self.student)
+        self.assertEqual(get_entitlements(self.user).course_ids, {course.pk})
+        course.student_set.clear()
+        self.assertEqual(get_entitlements(self.user).course_ids, set())
+        self.student.courses_enlisted.add(course)
+        self.student.courses_enlisted.remove(course)
+        self.assertEqual(get_entitlements(self.user).course_ids, set())
+
+    def test_subscription_changes_invalidate(self):
+        self.assertFalse(get_entitlements(self.user).has_active_subscription)
+        self.student.subscribe(1)
+        self.assertTrue(get_entitlements(self.user).has_active_subscription)
+        self.student.cancel_subscription()
+        self.assertFalse(get_entitlements(self.user).paid)
+
+    def test_non_students_have_none(self):
+        instructor = CustomUser.objects.get(email="instructor@example.com")
+        self.assertIsNone(get_entitlements(instructor))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_entitlements(instructor))
+
+
+class LessonRetrieveTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.course = make_course(instructor)
+        self.lesson = make_lesson(make_curriculum(self.course))
+        self.other_lesson = make_lesson(make_curriculum(make_course(instructor)))
+        self.user = make_student()
+        self.user.student.courses_enlisted.add(self.course)
+        self.client.force_authenticate(self.user)
+
+    def test_enrolled_lesson_takes_one_query(self):
+        self.client.get(f"/api/lesson/{self.lesson.pk}/")
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/lesson/{self.lesson.pk}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["title"], self.lesson.title)
+
+    def test_lesson_of_another_course_is_forbidden(self):
+        response = self.client.get(f"/api/lesson/{self.other_lesson.pk}/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_lessons_are_not_found(self):
+        self.assertEqual(self.client.get("/api/lesson/0/").status_code, 404)
+        self.assertEqual(self.client.get("/api/lesson/abc/").status_code, 404)
+
+    def test_non_students_are_forbidden(self):
+        self.client.force_authenticate(
+            CustomUser.objects.get(email="instructor@example.com")
+        )
+        response = self.client.get(f"/api/lesson/{self.lesson.pk}/")
+        self.assertEqual(response.status_code, 403)
+
+
+class LessonCourseTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.course = make_course(instructor)
+        self.other_course = make_course(instructor)
+        self.curriculum = make_curriculum(self.course)
+        self.lesson = make_lesson(self.curriculum)
+
+    def test_lesson_takes_its_curriculums_course(self):
+        self.assertEqual(self.lesson.course_id, self.course.pk)
+        lesson = Lesson.objects.get(pk=self.lesson.pk)
+        lesson.title = "Renamed"
+        lesson.save(update_fields=["title"])
+        self.assertEqual(Lesson.objects.get(pk=lesson.pk).course_id, self.course.pk)
+
+    def test_moving_a_curriculum_moves_its_lessons(self):
+        self.curriculum.course = self.other_course
+        self.curriculum.save()
+        self.assertEqual(
+            Lesson.objects.get(pk=self.lesson.pk).course_id, self.other_course.pk
+        )
+
+    def test_lesson_list_only_has_enrolled_courses(self):
+        make_lesson(make_curriculum(self.other_course))
+        user = make_student()
+        user.student.courses_enlisted.add(self.course)
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/lesson/")
+        self.assertEqual(
+            [lesson["id"] for lesson in response.data["results"]], [self.lesson.pk]
+        )
+
+
+@skipUnless(search.search_available(), "Search needs SQLite FTS5")
+class SearchTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.course = make_course(instructor, title="Web security")
+        self.other_course = make_course(
+            instructor, title="Cryptography <b>basics</b>", category="PAID"
+        )
+        self.lesson = Lesson.objects.create(
+            title="Injections",
+            sequence_number=1,
+            content="All about SQL injection",
+            duration="10m",
+            curriculum=make_curriculum(self.course),
+        )
+
+    def search(self, **params):
+        response = self.client.get("/api/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"]
+
+    def test_hits_are_highlighted_and_escaped(self):
+        [hit] = self.search(q="web secu")
+        self.assertEqual(hit["type"], "course")
+        self.assertEqual(hit["title"], "<mark>Web</mark> <mark>security</mark>")
+        [hit] = self.search(q="crypto")
+        self.assertEqual(
+            hit["title"], "<mark>Cryptography</mark> &lt;b&gt;basics&lt;/b&gt;"
+        )
+
+    def test_filters(self):
+        self.assertEqual(
+            [hit["id"] for hit in self.search(q="crypto", category="PAID")],
+            [self.other_course.pk],
+        )
+        self.assertEqual(self.search(q="crypto", category="FREE"), [])
+        self.assertEqual(
+            [hit["type"] for hit in self.search(q="injection", type="lesson")],
+            ["lesson"],
+        )
+
+    def test_lesson_snippets_need_enrollment(self):
+        [hit] = self.search(q="injection", type="lesson")
+        self.assertIsNone(hit["snippet"])
+        user = make_student()
+        user.student.courses_enlisted.add(self.course)
+        self.client.force_authenticate(user)
+        [hit] = self.search(q="injection", type="lesson", enrolled=1)
+        self.assertIn("<mark>injection</mark>", hit["snippet"])
+
+    def test_index_follows_writes(self):
+        self.course.title = "Network defense"
+        self.course.save()
+        self.assertEqual(self.search(q="web"), [])
+        self.assertEqual(len(self.search(q="network")), 1)
+        self.other_course.delete()
+        self.assertEqual(self.search(q="crypto"), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search(q='AND OR "NEAR( *'), [])
+
+    def test_bad_requests(self):
+        with self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.client.get("/api/search/").status_code, 400)
+            self.assertEqual(
+                self.client.get("/api/search/", {"q": "web", "type": "x"}).status_code,
+                400,
+            )
+
+
+class AutocompleteTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.course = make_course(instructor, title="Écoles: Web-Security 101")
+        make_curriculum(self.course, title="Web basics")
+        make_curriculum(self.course, title="Web advanced")
+
+    def titles(self, **params):
+        response = self.client.get("/api/autocomplete/", params)
+        self.assertEqual(response.status_code, 200)
+        return [result["title"] for result in response.data["results"]]
+
+    def test_matches_any_word_prefix(self):
+        self.assertEqual(self.titles(q="ecol"), ["Écoles: Web-Security 101"])
+        self.assertEqual(self.titles(q="secu"), ["Écoles: Web-Security 101"])
+        self.assertEqual(
+            sorted(self.titles(q="web")),
+            ["Web advanced", "Web basics", "Écoles: Web-Security 101"],
+        )
+        self.assertEqual(len(self.titles(q="web", limit=2)), 2)
+        self.assertEqual(self.titles(q=""), [])
+
+    def test_served_from_memory(self):
+        self.titles(q="web")
+        with self.assertNumQueries(0):
+            self.titles(q="basics")
+
+    def test_title_starts_are_never_crowded_out(self):
+        entries = [
+            ("course", pk, pk, f"Advanced security topic {pk}") for pk in range(60)
+        ]
+        entries.append(("course", 60, 60, "Serverless"))
+        index = PrefixIndex(entries)
+        self.assertEqual(index.lookup("se", 10)[0][3], "Serverless")
+        # Among other word starts, shorter titles first
+        self.assertEqual(
+            [entry[1] for entry in index.lookup("topic", 3)], [0, 1, 2]
+        )
+
+    @override_settings(AUTOCOMPLETE_INDEX_MAX_AGE=60)
+    def test_index_is_rebuilt_when_too_old(self):
+        self.titles(q="web")
+        # bulk_create sends no signal, like a write from another process
+        Course.objects.bulk_create(
+            [
+                Course(
+                    title="Forensics",
+                    description="Course description",
+                    category="FREE",
+                    duration="1h",
+                    difficulty="BEGINNER",
+                    instructor=self.course.instructor,
+                )
+            ]
+        )
+        self.assertEqual(self.titles(q="fore"), [])
+        later = time.monotonic() + 61
+        with mock.patch("api.autocomplete.time.monotonic", return_value=later):
+            self.assertEqual(self.titles(q="fore"), ["Forensics"])
+
+    def test_index_follows_catalog_writes(self):
+        self.titles(q="web")
+        self.course.title = "Forensics"
+        self.course.save()
+        self.assertEqual(self.titles(q="ecol"), [])
+        self.assertEqual(self.titles(q="fore"), ["Forensics"])
+
+
+@override_settings(JWT_ENTITLEMENT_CLAIMS=True)
+class EntitlementClaimsTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.courses = [make_course(instructor, title=f"Course {i}") for i in range(2)]
+        self.lesson = make_lesson(make_curriculum(self.courses[0]))
+        self.user = make_student(paid=True)
+        self.user.student.courses_enlisted.add(self.courses[0])
+
+    def login(self):
+        tokens = self.client.post(
+            "/api/token/", {"email": "student@example.com", "password": "password"}
+        ).data
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + tokens["access"])
+        return tokens
+
+    def test_course_ids_round_trip(self):
+        for course_ids in (set(), {1}, {3, 4, 10, 500}, set(range(7, 100, 3))):
+            with self.subTest(course_ids=course_ids):
+                self.assertEqual(
+                    decode_course_ids(encode_course_ids(course_ids)), course_ids
+                )
+
+    def test_access_token_carries_entitlements(self):
+        claims = AccessToken(self.login()["access"])["ent"]
+        self.assertEqual(claims["sid"], self.user.student.pk)
+        self.assertTrue(claims["paid"])
+        self.assertEqual(decode_course_ids(claims["crs"]), {self.courses[0].pk})
+
+    def test_lessons_are_authorized_from_the_token(self):
+        self.login()
+        url = f"/api/lesson/{self.lesson.pk}/"
+        self.client.get(url)
+        cache.delete(entitlements_key(self.user.pk))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_stale_claims_need_a_refresh(self):
+        tokens = self.login()
+        self.user.student.courses_enlisted.add(self.courses[1])
+        self.assertEqual(self.client.get("/api/lesson/").status_code, 401)
+
+        refreshed = self.client.post("/api/token/refresh/", {"refresh": tokens["refresh"]})
+        claims = AccessToken(refreshed.data["access"])["ent"]
+        self.assertEqual(
+            decode_course_ids(claims["crs"]), {course.pk for course in self.courses}
+        )
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + refreshed.data["access"])
+        self.assertEqual(self.client.get("/api/lesson/").status_code, 200)
+
+    def test_claims_can_be_turned_off(self):
+        with self.settings(JWT_ENTITLEMENT_CLAIMS=False):
+            self.assertNotIn("ent", AccessToken(self.login()["access"]))
+
+
+class ExpireSubscriptionsTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.paid_course = make_course(instructor, title="Paid", category="PAID")
+        self.free_course = make_course(instructor, title="Free")
+        self.lapsed = self.subscriber("lapsed@example.com", days=-1)
+        self.current = self.subscriber("current@example.com", days=3)
+
+    def subscriber(self, email, days):
+        user = make_student(email, paid=True)
+        user.student.courses_enlisted.add(self.paid_course, self.free_course)
+        Student.objects.filter(user=user).update(
+            subscription_end=timezone.now() + timedelta(days=days)
+        )
+        return user
+
+    def expire(self, **options):
+        call_command("expire_subscriptions", sleep=0, stdout=StringIO(), **options)
+
+    def enrolled(self, user):
+        return set(
+            Student.objects.get(user=user).courses_enlisted.values_list(
+                "title", flat=True
+            )
+        )
+
+    def test_lapsed_students_lose_paid_courses(self):
+        self.expire()
+        self.assertFalse(Student.objects.get(user=self.lapsed).paid)
+        self.assertEqual(self.enrolled(self.lapsed), {"Free"})
+        self.assertTrue(Student.objects.get(user=self.current).paid)
+        self.assertEqual(self.enrolled(self.current), {"Paid", "Free"})
+
+    def test_batches_cover_every_student(self):
+        others = [self.subscriber(f"lapsed{i}@example.com", days=-2) for i in range(4)]
+        self.expire(batch_size=2)
+        for user in [self.lapsed, *others]:
+            self.assertEqual(self.enrolled(user), {"Free"})
+
+    def test_cached_entitlements_are_invalidated(self):
+        self.assertTrue(get_entitlements(self.lapsed).paid)
+        get_cached_user(self.lapsed.pk)
+        self.expire()
+        entitlements = get_entitlements(self.lapsed)
+        self.assertFalse(entitlements.paid)
+        self.assertEqual(entitlements.course_ids, {self.free_course.pk})
+        self.assertFalse(get_cached_user(self.lapsed.pk).student.paid)
+
+    def test_nothing_to_expire(self):
+        Student.objects.filter(user=self.lapsed).update(paid=False)
+        output = StringIO()
+        call_command("expire_subscriptions", stdout=output)
+        self.assertIn("No expired subscriptions.", output.getvalue())
+
+
+class SubscriptionStateTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for email, days in (
+            ("expired@example.com", -2),
+            ("expiring@example.com", 1),
+            ("active@example.com", 40),
+            ("open-ended@example.com", None),
+        ):
+            user = make_student(email, paid=True)
+            Student.objects.filter(user=user).update(
+                subscription_end=None
+                if days is None
+                else timezone.now() + timedelta(days=days)
+            )
+        make_student("free@example.com")
+
+    def emails(self, queryset):
+        return set(queryset.values_list("user__email", flat=True))
+
+    def test_querysets(self):
+        self.assertEqual(
+            self.emails(Student.objects.active()),
+            {"expiring@example.com", "active@example.com"},
+        )
+        self.assertEqual(
+            self.emails(Student.objects.expiring_within(7)), {"expiring@example.com"}
+        )
+        self.assertEqual(
+            self.emails(Student.objects.expired()), {"expired@example.com"}
+        )
+
+    def test_states(self):
+        self.assertEqual(
+            dict(
+                Student.objects.with_subscription_state().values_list(
+                    "user__email", "subscription_state"
+                )
+            ),
+            {
+                "expired@example.com": "expired",
+                "expiring@example.com": "active",
+                "active@example.com": "active",
+                "open-ended@example.com": "none",
+                "free@example.com": "none",
+            },
+        )
+
+    def test_serializer_matches_annotation(self):
+        annotated = dict(
+            Student.objects.with_subscription_state().values_list(
+                "user_id", "subscription_state"
+            )
+        )
+        for user in CustomUser.objects.filter(user_type=CustomUser.STUDENT):
+            with self.subTest(email=user.email):
+                self.assertEqual(
+                    ProfileViewSet.serializer_class(user).data["subscription_state"],
+                    annotated[user.pk],
+                )
+
+    def test_profile_reports_state(self):
+        self.client.force_authenticate(
+            CustomUser.objects.get(email="expired@example.com")
+        )
+        response = self.client.get("/api/profile/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["subscription_state"], "expired")
+
+    def test_paid_without_end_is_not_active(self):
+        self.assertFalse(Student(paid=True).has_active_subscription)
+
+
+class SubscriptionRenewalTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_student()
+        self.student = self.user.student
+
+    def test_subscribe_starts_a_period(self):
+        self.student.subscribe(2)
+        self.assertTrue(self.student.paid)
+        self.assertEqual(
+            self.student.subscription_end - self.student.subscription_start,
+            timedelta(days=60),
+        )
+
+    def test_renewals_stack_on_an_active_subscription(self):
+        self.student.renew_subscription(1)
+        start, end = self.student.subscription_start, self.student.subscription_end
+        # A second instance doesn't see the first renewal, like a concurrent request
+        Student.objects.get(pk=self.student.pk).renew_subscription(1)
+        self.student.renew_subscription(1)
+        self.assertEqual(self.student.subscription_start, start)
+        self.assertEqual(self.student.subscription_end, end + timedelta(days=60))
+
+    def test_renewal_after_expiry_starts_over(self):
+        self.student.subscribe(1)
+        Student.objects.filter(pk=self.student.pk).update(
+            subscription_end=timezone.now() - timedelta(days=1)
+        )
+        self.student.renew_subscription(1)
+        self.assertTrue(self.student.has_active_subscription)
+        self.assertEqual(
+            self.student.subscription_end - self.student.subscription_start,
+            timedelta(days=30),
+        )
+
+    def test_extend_needs_an_active_subscription(self):
+        self.assertFalse(self.student.extend_subscription(1))
+        self.assertFalse(self.student.paid)
+        self.student.subscribe(1)
+        end = self.student.subscription_end
+        self.assertTrue(self.student.extend_subscription(1))
+        self.assertEqual(self.student.subscription_end, end + timedelta(days=30))
+
+    def test_cancel_drops_paid_courses(self):
+        instructor = make_instructor()
+        paid = make_course(instructor, title="Paid", category="PAID")
+        free = make_course(instructor, title="Free")
+        self.student.subscribe(1)
+        self.student.courses_enlisted.add(paid, free)
+        self.student.cancel_subscription()
+        self.assertFalse(self.student.paid)
+        self.assertIsNone(self.student.subscription_end)
+        self.assertEqual(list(self.student.courses_enlisted.all()), [free])
+
+    def test_views_update_the_subscription(self):
+        self.client.force_authenticate(self.user)
+        self.client.post("/api/subscribe/", {"duration_months": 1})
+        self.assertTrue(get_entitlements(self.user).has_active_subscription)
+        end = Student.objects.get(pk=self.student.pk).subscription_end
+
+        response = self.client.post("/api/extend_subscription/", {"duration_months": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            Student.objects.get(pk=self.student.pk).subscription_end,
+            end + timedelta(days=30),
+        )
+
+        self.client.post("/api/unsubscribe/")
+        self.assertFalse(get_entitlements(self.user).paid)
+
+
+class PaymentTransitionTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_student()
+        make_payment(self.user, "1001")
+
+    def status(self):
+        return Payment.objects.get(payment_id="1001").payment_status
+
+    def test_forward_transitions_apply(self):
+        for payment_status in ("confirming", "confirmed", "sending", "finished"):
+            with self.subTest(payment_status=payment_status):
+                self.assertTrue(transition("1001", payment_status))
+                self.assertEqual(self.status(), payment_status)
+
+    def test_late_and_repeated_statuses_are_ignored(self):
+        transition("1001", "finished")
+        for payment_status in ("confirming", "partially_paid", "finished", "waiting"):
+            with self.subTest(payment_status=payment_status):
+                self.assertFalse(transition("1001", payment_status))
+                self.assertEqual(self.status(), "finished")
+
+    def test_refunds_follow_a_payment(self):
+        self.assertFalse(transition("1001", "refunded"))
+        transition("1001", "partially_paid")
+        self.assertTrue(transition("1001", "refunded"))
+        self.assertFalse(transition("1001", "finished"))
+
+    def test_late_callbacks_are_recorded_not_applied(self):
+        make_ipn_message("1001", "finished")
+        make_ipn_message("1001", "confirming")
+        make_ipn_message("1001", "partially_paid")
+        with self.assertLogs("api.payments", "INFO"):
+            process_inbox()
+        self.assertEqual(self.status(), "finished")
+        self.assertEqual(
+            list(PaymentEvent.objects.order_by("id").values_list("applied", flat=True)),
+            [True, False, False],
+        )
+        student = Student.objects.get(user=self.user)
+        self.assertEqual(
+            student.subscription_end - student.subscription_start, timedelta(days=30)
+        )
+
+    def test_unknown_status_is_an_error(self):
+        message = make_ipn_message("1001", "teleported")
+        with self.assertLogs("api.payments", "ERROR"):
+            process_inbox()
+        message.refresh_from_db()
+        self.assertIn("Unhandled payment status", message.error)
+        self.assertEqual(self.status(), "waiting")
+
+
+class EnrollTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instructor = make_instructor()
+        self.free = make_course(instructor, title="Free")
+        self.paid = make_course(instructor, title="Paid", category="PAID")
+        self.taken = make_course(instructor, title="Taken")
+        self.user = make_student()
+        self.user.student.courses_enlisted.add(self.taken)
+        self.client.force_authenticate(self.user)
+
+    def enroll(self, data):
+        return self.client.post("/api/enroll/", data, format="json")
+
+    def test_bulk_enroll_reports_each_course(self):
+        response = self.enroll(
+            {"course_ids": [self.free.pk, self.paid.pk, self.taken.pk, 999, self.free.pk]}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"course_id": self.free.pk, "status": "enrolled"},
+                {"course_id": self.paid.pk, "status": "unpaid"},
+                {"course_id": self.taken.pk, "status": "already_enrolled"},
+                {"course_id": 999, "status": "not_found"},
+            ],
+        )
+        self.assertEqual(
+            set(self.user.student.courses_enlisted.all()), {self.free, self.taken}
+        )
+
+    def test_bulk_enroll_uses_a_constant_number_of_queries(self):
+        instructor = Instructor.objects.get()
+        courses = [make_course(instructor, title=f"Course {i}") for i in range(10)]
+        with CaptureQueriesContext(connection) as queries:
+            self.enroll({"course_ids": [course.pk for course in courses[:2]]})
+        with self.assertNumQueries(len(queries)):
+            self.enroll({"course_ids": [course.pk for course in courses[2:]]})
+
+    def test_invalid_course_ids(self):
+        for course_ids in ([], ["one"], "1,2", list(range(1, 102))):
+            with self.subTest(course_ids=course_ids):
+                self.assertEqual(self.enroll({"course_ids": course_ids}).status_code, 400)
+
+    def test_legacy_single_course(self):
+        self.assertEqual(self.enroll({"course_id": 999}).status_code, 404)
+        self.assertEqual(self.enroll({"course_id": self.paid.pk}).status_code, 403)
+        self.assertEqual(self.enroll({"course_id": self.free.pk}).status_code, 200)
+        self.assertEqual(self.enroll({"course_id": self.free.pk}).status_code, 200)
+
+    def test_form_data_repeats_the_key(self):
+        response = self.client.post(
+            "/api/enroll/", {"course_ids": [self.free.pk, self.paid.pk]}
+        )
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["enrolled", "unpaid"],
+        )
+
+    def test_paid_students_enroll_in_paid_courses(self):
+        self.user.student.subscribe(1)
+        response = self.enroll({"course_ids": [self.paid.pk]})
+        self.assertEqual(response.data["results"][0]["status"], "enrolled")
+
+    def test_entitlements_are_invalidated(self):
+        get_entitlements(self.user)
+        self.enroll({"course_ids": [self.free.pk]})
+        self.assertEqual(
+            get_entitlements(self.user).course_ids, {self.free.pk, self.taken.pk}
+        )
+
+    def test_instructors_cannot_enroll(self):
+        instructor = CustomUser.objects.get(user_type=CustomUser.INSTRUCTOR)
+        self.client.force_authenticate(instructor)
+        self.assertEqual(self.enroll({"course_ids": [self.free.pk]}).status_code, 403)
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .blacklist import token_blacklist
+from .entitlements import ENTITLEMENTS_CLAIM, entitlement_claims
+
+
+class EntitlementRefreshToken(RefreshToken):
+    """
+    Refresh token whose access tokens carry the user's entitlements when
+    ``JWT_ENTITLEMENT_CLAIMS`` is on. The claims are computed afresh every
+    time an access token is issued, on login and on refresh alike, and are
+    never stored on the refresh token itself.
+
+    The blacklist check goes through the in-memory filter of api.blacklist,
+    so only tokens that may actually be blacklisted cost a query.
+    """
+
+    def check_blacklist(self):
+        if token_blacklist.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        if settings.JWT_ENTITLEMENT_CLAIMS:
+            access[ENTITLEMENTS_CLAIM] = entitlement_claims(
+                self.payload[api_settings.USER_ID_CLAIM]
+            )
+        return access
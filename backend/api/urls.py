@@ -23,9 +23,15 @@ urlpatterns = [
     path('extend_subscription/', views.ExtendSubscribeView.as_view(), name='extend_subscription'),
     path('unsubscribe/', views.UnSubscribeView.as_view(), name='unsubscribe'),
     path('ipn/', views.IPNCallbackView.as_view(), name='ipn-callback'),
+    path('payments/<str:payment_id>/events/', views.PaymentEventListView.as_view(), name='payment_events'),
+    path('reports/revenue/', views.RevenueReportView.as_view(), name='revenue_report'),
     path('save-invoice/', views.SaveInvoiceView.as_view(), name='save_invoice'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('autocomplete/', views.AutocompleteView.as_view(), name='autocomplete'),
     path('contact/', views.ContactMessageView.as_view(), name='contact'),
+    path('catalog-cache/stats/', views.catalog_cache_stats_view, name='catalog_cache_stats'),
     path('course/<int:course_id>/image/', views.course_image, name='course_image'),
+    path('course/<int:course_id>/images/<str:slot>/', views.course_image_variant, name='course_image_variant'),
     # path('authorization/', views.authorizationInfo, name='authorization_info'),
     path('', include(router.urls)),
     # path('', views.getRoutes)
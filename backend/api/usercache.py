@@ -0,0 +1,195 @@
+"""
+Cache of authenticated users (with their student/instructor profile) so that
+JWT authentication doesn't query the database on every request.
+
+Users are cached per process in a small TTL'd LRU and in the shared Django
+cache, both keyed by user id and a per-user version stamp kept in the shared
+cache. api.signals bumps the stamp whenever the user or their profile is
+saved or deleted (password changes and deactivation included), which makes
+every cached copy unreachable at once.
+
+Only the column values are cached, never model instances, and every lookup
+builds fresh instances from them, so concurrent requests never share (or
+mutate) the same user. The password hash isn't cached; the token revocation
+claim derived from it is, when CHECK_REVOKE_TOKEN is on.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import CustomUser, Instructor, Student
+
+# Loaded on access like any deferred field
+UNCACHED_USER_FIELDS = ("password",)
+
+PROFILES = (("student", Student), ("instructor", Instructor))
+
+
+def user_version_key(user_id):
+    return f"auth:user:version:{user_id}"
+
+
+def user_key(user_id, version):
+    return f"auth:user:{user_id}:{version}"
+
+
+def user_version(user_id):
+    key = user_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock so a lost stamp never matches older entries
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_user_versions(*user_ids):
+    """
+    Bump the stamps now and again once the current transaction commits, in
+    case a concurrent request re-cached the old state meanwhile.
+    """
+    if not user_ids:
+        return
+
+    def bump():
+        for user_id in user_ids:
+            try:
+                cache.incr(user_version_key(user_id))
+            except ValueError:
+                cache.add(user_version_key(user_id), time.time_ns(), timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+class LocalUserCache:
+    """Thread-safe LRU of ``(user_id, version) -> snapshot`` with a TTL."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, snapshot = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return snapshot
+
+    def set(self, key, snapshot):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, snapshot)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_users = LocalUserCache(
+    settings.AUTH_USER_LOCAL_CACHE_SIZE, settings.AUTH_USER_LOCAL_CACHE_TTL
+)
+
+
+def load_user(user_id):
+    return (
+        CustomUser.objects.select_related("student", "instructor")
+        .filter(pk=user_id)
+        .first()
+    )
+
+
+def cached_fields(model, exclude=()):
+    return tuple(
+        field.attname
+        for field in model._meta.concrete_fields
+        if field.attname not in exclude
+    )
+
+
+def take_snapshot(user):
+    """The cacheable column values of ``user`` and its profiles."""
+    snapshot = {
+        "user": tuple(
+            getattr(user, name)
+            for name in cached_fields(CustomUser, UNCACHED_USER_FIELDS)
+        ),
+        "revoke_claim": (
+            get_md5_hash_password(user.password)
+            if api_settings.CHECK_REVOKE_TOKEN
+            else None
+        ),
+    }
+    for name, model in PROFILES:
+        profile = getattr(user, name, None)
+        snapshot[name] = (
+            None
+            if profile is None
+            else tuple(getattr(profile, field) for field in cached_fields(model))
+        )
+    return snapshot
+
+
+def build_user(snapshot):
+    """A new user instance, with its profiles attached, from a snapshot."""
+    user = CustomUser.from_db(
+        DEFAULT_DB_ALIAS,
+        cached_fields(CustomUser, UNCACHED_USER_FIELDS),
+        snapshot["user"],
+    )
+    for name, model in PROFILES:
+        related = CustomUser._meta.get_field(name)
+        values = snapshot[name]
+        if values is None:
+            # Cached absence, hasattr(user, "student") stays query-free
+            related.set_cached_value(user, None)
+            continue
+        profile = model.from_db(DEFAULT_DB_ALIAS, cached_fields(model), values)
+        related.set_cached_value(user, profile)
+        related.field.set_cached_value(profile, user)
+    return user
+
+
+def get_user_snapshot(user_id):
+    """
+    Return the snapshot of the user with ``user_id`` (None if there is
+    none) from the local LRU, the shared cache or the database, in that
+    order.
+    """
+    version = user_version(user_id)
+    key = (user_id, version)
+    snapshot = local_users.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    shared_key = user_key(user_id, version)
+    snapshot = cache.get(shared_key)
+    if snapshot is None:
+        user = load_user(user_id)
+        if user is None:
+            return None
+        snapshot = take_snapshot(user)
+        cache.set(shared_key, snapshot, settings.AUTH_USER_CACHE_TIMEOUT)
+    local_users.set(key, snapshot)
+    return snapshot
+
+
+def get_cached_user(user_id):
+    """Return a fresh instance of the user with ``user_id``, None if there is none."""
+    snapshot = get_user_snapshot(user_id)
+    return build_user(snapshot) if snapshot is not None else None
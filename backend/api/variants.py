@@ -0,0 +1,159 @@
+"""
+On-demand image derivatives (resized and/or re-encoded course images) kept
+in a size-bounded LRU cache on disk.
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import weakref
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Requested widths are rounded up to one of these to bound the variant count
+WIDTH_BUCKETS = (160, 320, 480, 640, 960, 1280, 1920)
+
+# ?format= value -> Pillow format
+FORMATS = {
+    "webp": "WEBP",
+    "jpeg": "JPEG",
+    "png": "PNG",
+}
+
+QUALITY = 80
+
+
+def bucket_width(width):
+    for bucket in WIDTH_BUCKETS:
+        if width <= bucket:
+            return bucket
+    return WIDTH_BUCKETS[-1]
+
+
+def variant_key(source_id, width, fmt):
+    return hashlib.sha256(f"{source_id}:{width}:{fmt}".encode()).hexdigest()
+
+
+def build_variant(source, width, fmt):
+    """Resize ``source`` (a file object) to at most ``width`` pixels wide."""
+    pil_format = FORMATS[fmt]
+    with source, Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if width and image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        output = io.BytesIO()
+        image.save(output, pil_format, quality=QUALITY, optimize=True)
+    return output.getvalue()
+
+
+class VariantCache:
+    """
+    Directory of built variants evicted least-recently-used first once it
+    grows past ``max_bytes``. A file's mtime is bumped on every hit and is
+    what recency is measured by.
+
+    Builds of the same key are serialized with a per-key lock, so concurrent
+    requests in a process build a variant once. Files are written through a
+    rename, so processes racing on the same key can only both write it, never
+    serve a partial file.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+        self._key_locks = weakref.WeakValueDictionary()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_build(self, key, build):
+        path = self.get(key)
+        if path:
+            return path
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Someone may have built it while we waited for the lock
+            path = self.get(key)
+            if path:
+                return path
+            return self.put(key, build())
+
+    def put(self, key, data):
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp:
+            tmp.write(data)
+        os.replace(tmp.name, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _entries(self):
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _disk_usage(self):
+        return sum(size for _mtime, size, _path in self._entries())
+
+    def _evict(self):
+        # Rescan, other processes share the directory
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        # Evict down to 90% so we don't evict again on the next write
+        target = self.max_bytes * 0.9
+        for _mtime, file_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        logger.info("Image variant cache evicted down to %d bytes", size)
+        self._size = size
+
+
+_cache = None
+
+
+def variant_cache():
+    global _cache
+    if _cache is None:
+        _cache = VariantCache(
+            settings.IMAGE_VARIANT_CACHE_DIR, settings.IMAGE_VARIANT_CACHE_MAX_BYTES
+        )
+    return _cache
@@ -4,8 +4,7 @@ from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework import generics, permissions, viewsets
 from .serializers import (
@@ -13,23 +12,50 @@ from .serializers import (
     RegisterSerializer,
     ProfileSerializer,
     CourseSerializer,
+    CourseCardSerializer,
     CurriculumSerializer,
     LessonSerializer,ContactMessageSerializer,
+    PaymentEventSerializer,
 )
-from .models import CustomUser, Instructor, Student, Course, Curriculum, Lesson, Payment
+from .cache import CatalogCacheMixin, catalog_cache_stats, shared_cache_configured
+from .conditional import ConditionalGetMixin
+from .entitlements import entitlements_version, get_entitlements, invalidate_entitlements
+from .manager import subscription_state
+from .models import CustomUser, Instructor, Student, Course, Curriculum, Lesson, Payment, IPNMessage, PaymentEvent
 from .permissions import IsPaidStudent
+from . import ipn, reports, search
+from .autocomplete import autocomplete
+from .storage import content_hash_from_name
+from .tokens import EntitlementRefreshToken
+from .variants import (
+    FORMATS,
+    WIDTH_BUCKETS,
+    build_variant,
+    bucket_width,
+    variant_cache,
+    variant_key,
+)
+from .images import (
+    IMAGE_VERSION_LENGTH,
+    cache_control,
+    content_hash,
+    file_content_hash,
+    image_response,
+    not_modified,
+)
 
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
-import json, hmac, hashlib
+from django.core.files import File
+from django.db.models import Count, Exists, Max, OuterRef
+from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import require_safe
+from PIL import Image
+import io, logging
+from datetime import date, timedelta
 from django.conf import settings
 
-import environ
-
-# Setting up environ variables
-env = environ.Env()
-
-environ.Env.read_env()
+logger = logging.getLogger(__name__)
 
 
 # Create your views here.
@@ -42,7 +68,7 @@ def logout(request):
     refresh_token = request.data.get("refresh_token")
     if refresh_token:
         try:
-            token = RefreshToken(refresh_token)
+            token = EntitlementRefreshToken(refresh_token)
             token.blacklist()
             return Response(
                 {"message": "User logout successful"}, status=status.HTTP_200_OK
@@ -67,17 +93,26 @@ class ProfileViewSet(viewsets.ModelViewSet):
     serializer_class = ProfileSerializer
 
     def get_queryset(self):
-        return CustomUser.objects.filter(pk=self.request.user.pk)
+        return CustomUser.objects.filter(pk=self.request.user.pk).annotate(
+            subscription_state=subscription_state("student__")
+        )
 
     def get_object(self):
         queryset = self.get_queryset()
         obj = queryset.first()  # Assuming there's only one object per user
         return obj
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # ?image=url lists enlisted courses with image URLs instead of base64
+        if self.request.query_params.get("image") == CourseSerializer.IMAGE_FORMAT_URL:
+            context["image_format"] = CourseSerializer.IMAGE_FORMAT_URL
+        return context
+
     def list(self, request):
         instance = self.get_object()
         # print("Retrieved user instance:", instance)
-        serializer = self.serializer_class(instance)
+        serializer = self.get_serializer(instance)
         # print("Serialized data:", serializer.data)
         return Response(serializer.data)
 
@@ -113,11 +148,60 @@ def authorizationInfo(request):
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     parser_classes = (MultiPartParser, FormParser)
     queryset = Course.objects.all()
     permission_classes = [AllowAny]
     serializer_class = CourseSerializer
+    keyset_ordering = ("publication_date", "id")
+    validator_aggregates = {
+        "updated": Max(Coalesce("revision_date", "publication_date")),
+        "lesson_count": Count("lessons", distinct=True),
+        "lessons_updated": Max(
+            Coalesce("lessons__last_updated", "lessons__creation_date")
+        ),
+    }
+
+    # GET /api/course/?mode=card returns course cards only
+    CARD_MODE = "card"
+
+    def is_card_mode(self):
+        return (
+            self.action == "list"
+            and self.request.query_params.get("mode") == self.CARD_MODE
+        )
+
+    def is_image_url_mode(self):
+        return (
+            self.request.query_params.get("image") == CourseSerializer.IMAGE_FORMAT_URL
+        )
+
+    def get_queryset(self):
+        queryset = super().get_queryset().select_related("instructor__user")
+        if self.is_card_mode():
+            # Cards never touch the binary image columns
+            return queryset.defer("image", "image_blob")
+        queryset = queryset.prefetch_related("curriculums__lessons")
+        if self.is_image_url_mode() and self.request.method == "GET":
+            queryset = queryset.defer("image", "image_blob")
+        return queryset
+
+    def get_validator_aggregates(self):
+        if self.is_card_mode():
+            # Cards don't include the lessons
+            return {"updated": self.validator_aggregates["updated"]}
+        return super().get_validator_aggregates()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.is_image_url_mode():
+            context["image_format"] = CourseSerializer.IMAGE_FORMAT_URL
+        return context
+
+    def get_serializer_class(self):
+        if self.is_card_mode():
+            return CourseCardSerializer
+        return super().get_serializer_class()
     
     
     # @action(detail=True, methods=['post'])
@@ -131,74 +215,282 @@ class CourseViewSet(viewsets.ModelViewSet):
     #     return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class CurriculumViewSet(viewsets.ModelViewSet):
+class CurriculumViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Curriculum.objects.all()
     permission_classes = [AllowAny]
     serializer_class = CurriculumSerializer
+    keyset_ordering = ("course_id", "id")
+    validator_aggregates = {
+        "updated": Max(
+            Coalesce("course__revision_date", "course__publication_date")
+        ),
+        "lesson_count": Count("lessons", distinct=True),
+        "lessons_updated": Max(
+            Coalesce("lessons__last_updated", "lessons__creation_date")
+        ),
+    }
+
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related("lessons")
     
 
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def catalog_cache_stats_view(request):
+    return Response(catalog_cache_stats())
+
+
+@require_safe
 def course_image(request, course_id):
-    course = get_object_or_404(Course, pk=course_id)
-    return HttpResponse(course.image, content_type="image/jpeg") 
+    courses = Course.objects.filter(pk=course_id)
+    if request.headers.get("If-None-Match"):
+        # Revalidation only needs the stored hash, not the image itself
+        image_hash = courses.values_list("image_hash", flat=True).first()
+        if image_hash and not_modified(request, image_hash):
+            return image_response(request, b"", image_hash)
+
+    # Only read the image columns, never the rest of the course row
+    images = list(
+        courses.values_list(
+            "image_hash", "image_file", Coalesce("image", "image_blob")
+        )
+    )
+    if not images:
+        raise Http404("No image for this course.")
+    image_hash, image_name, data = images[0]
+    if image_name:
+        try:
+            image = Course._meta.get_field("image_file").storage.open(image_name)
+        except FileNotFoundError:
+            raise Http404("No image for this course.")
+        image_hash = image_hash or content_hash_from_name(image_name)
+    elif data:
+        image = data
+        image_hash = image_hash or content_hash(data)
+    else:
+        raise Http404("No image for this course.")
+
+    # A ?v= matching the current hash is a versioned URL that never changes
+    version = request.GET.get("v")
+    immutable = version == image_hash[:IMAGE_VERSION_LENGTH]
+    max_age = 60 * 60 * 24 * 365 if immutable else None
+    return image_response(
+        request, image, image_hash, cache_control(max_age, immutable=immutable)
+    )
+
+
+# Course images that can be served as resized/re-encoded variants
+VARIANT_SLOTS = ("image", "image1", "image2", "image3")
 
 
-class LessonViewSet(viewsets.ModelViewSet):
+@require_safe
+def course_image_variant(request, course_id, slot):
+    """
+    GET /api/course/<id>/images/<slot>/?w=<width>&format=<webp|jpeg|png>
+
+    Builds the variant on first request and serves it from the variant
+    cache afterwards. The width is rounded up to one of WIDTH_BUCKETS.
+    Variants are keyed by the source image's content hash.
+    """
+    if slot not in VARIANT_SLOTS:
+        raise Http404("Unknown image.")
+    try:
+        width = bucket_width(int(request.GET.get("w", WIDTH_BUCKETS[-1])))
+    except ValueError:
+        return HttpResponseBadRequest("w must be an integer.")
+    fmt = request.GET.get("format", "webp")
+    if fmt not in FORMATS:
+        return HttpResponseBadRequest("Unsupported format.")
+
+    courses = Course.objects.filter(pk=course_id)
+    field = Course._meta.get_field("image_file" if slot == "image" else slot)
+    if slot == "image":
+        row = courses.values_list("image_hash", "image_file").first()
+        source_hash, name = row if row else (None, None)
+    else:
+        name = courses.values_list(slot, flat=True).first()
+        try:
+            source_hash = name and file_content_hash(field.storage, name)
+        except FileNotFoundError:
+            source_hash = None
+    if not source_hash:
+        raise Http404("No image for this course.")
+
+    def open_source():
+        if name:
+            return field.storage.open(name)
+        # Not offloaded to the image store yet
+        data = courses.values_list(Coalesce("image", "image_blob"), flat=True).first()
+        return io.BytesIO(data)
+
+    # Versioned like image_url, by the source hash
+    version = request.GET.get("v")
+    immutable = version == source_hash[:IMAGE_VERSION_LENGTH]
+    max_age = 60 * 60 * 24 * 365 if immutable else None
+    cache_control_value = cache_control(max_age, immutable=immutable)
+
+    key = variant_key(source_hash, width, fmt)
+    if not_modified(request, key):
+        return image_response(request, b"", key, cache_control_value)
+    try:
+        path = variant_cache().get_or_build(
+            key, lambda: build_variant(open_source(), width, fmt)
+        )
+        image = File(open(path, "rb"))
+    except FileNotFoundError:
+        raise Http404("No image for this course.")
+    except (Image.DecompressionBombError, OSError):
+        # Not an image Pillow can decode: unknown format, truncated upload
+        # or too many pixels
+        logger.warning("Course %s %s can't be converted", course_id, slot)
+        return HttpResponse("Image can't be converted.", status=415)
+    return image_response(request, image, key, cache_control_value)
+
+
+class LessonViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
+    keyset_ordering = ("curriculum_id", "sequence_number", "id")
+    validator_aggregates = {"updated": Max(Coalesce("last_updated", "creation_date"))}
+
+    def get_etag_parts(self, request, **kwargs):
+        parts = super().get_etag_parts(request, **kwargs)
+        # Which lessons a student sees depends on their enrollments, the
+        # aggregate over get_queryset() already reflects them
+        if shared_cache_configured() and request.user.is_authenticated:
+            parts += (entitlements_version(request.user.pk),)
+        return parts
 
     def get_queryset(self):
-        user = self.request.user
-        if hasattr(user, "student"):
-            student = user.student
-            if student:
-                enlisted_courses = student.courses_enlisted.all()
-                print(f"Courses enlisted by student: {enlisted_courses}")
-                queryset = Lesson.objects.filter(
-                    curriculum__course__in=student.courses_enlisted.all()
-                )
-                print(f"Filtered lessons for student: {queryset}")
-                return queryset
-            else:
-                return Response(
-                    {"unenrolled": "You are not enrolled in any courses."},
-                    status=status.HTTP_403_FORBIDDEN,
-                )
-        else:
+        entitlements = get_entitlements(self.request.user, self.request.auth)
+        if entitlements is None:
             return Lesson.objects.none()
+        return Lesson.objects.filter(course_id__in=entitlements.course_ids)
 
     def retrieve(self, request, *args, **kwargs):
-        user = request.user
-        if not hasattr(user, "student"):
+        entitlements = get_entitlements(request.user, request.auth)
+        if entitlements is None:
             return Response(
                 {"detail": "You must be a student to access lessons."},
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        student = user.student
-        lesson_id = kwargs.get("pk")
-        print(lesson_id)
-
+        # Fetch the lesson and check the enrollment in a single statement
+        enrolled = Student.courses_enlisted.through.objects.filter(
+            student_id=entitlements.student_id,
+            course_id=OuterRef("course_id"),
+        )
         try:
-            lesson = Lesson.objects.get(pk=lesson_id)
-        except Lesson.DoesNotExist:
+            lesson = (
+                Lesson.objects.filter(pk=kwargs.get("pk"))
+                .annotate(enrolled=Exists(enrolled))
+                .first()
+            )
+        except (ValueError, TypeError):
+            lesson = None
+        if lesson is None:
             return Response(
                 {"detail": "No Lesson matches the given query."},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        course = lesson.curriculum.course
-
-        if course not in student.courses_enlisted.all():
+        if not lesson.enrolled:
             return Response(
                 {"detail": "You must be enrolled in this course to access the lesson."},
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        return super().retrieve(request, *args, **kwargs)
+        etag_parts = None
+        if not shared_cache_configured():
+            # The lesson is loaded already, no need for the aggregate
+            etag_parts = (1, lesson.last_updated or lesson.creation_date)
+        return self.conditional_response(
+            lambda request: Response(self.get_serializer(lesson).data),
+            request,
+            etag_parts=etag_parts,
+        )
+
+
+class SearchView(APIView):
+    """
+    Ranked full-text search over courses, curricula and lessons.
+
+    ``?q=`` is required; ``type``, ``category`` and ``difficulty`` filter the
+    hits and ``enrolled=1`` limits them to the user's own courses. Lesson
+    snippets are only shown to students enrolled in the lesson's course.
+    """
+
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        if not search.search_available():
+            return Response(
+                {"detail": "Search is not available on this database."},
+                status=status.HTTP_501_NOT_IMPLEMENTED,
+            )
+
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            return Response(
+                {"detail": "The q parameter is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        kind = request.query_params.get("type") or None
+        if kind is not None and kind not in search.KIND_CODES:
+            return Response(
+                {"detail": "type must be one of: %s." % ", ".join(search.KIND_CODES)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            limit = int(request.query_params.get("limit", 20))
+        except ValueError:
+            limit = 20
+
+        entitlements = get_entitlements(request.user, request.auth)
+        entitled_course_ids = entitlements.course_ids if entitlements else frozenset()
+        course_ids = None
+        if request.query_params.get("enrolled") in ("1", "true"):
+            course_ids = sorted(entitled_course_ids)
+
+        results = search.search(
+            text,
+            kind=kind,
+            category=request.query_params.get("category") or None,
+            difficulty=request.query_params.get("difficulty") or None,
+            course_ids=course_ids,
+            entitled_course_ids=entitled_course_ids,
+            limit=max(1, limit),
+        )
+        return Response({"count": len(results), "results": results})
+
+
+class AutocompleteView(APIView):
+    """
+    Course and curriculum titles starting with ``?q=`` (at any word), served
+    from the in-process prefix index without touching the database.
+    """
+
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            limit = 10
+        results = autocomplete(request.query_params.get("q", ""), max(1, limit))
+        return Response({"results": results})
 
 
 class EnrollView(APIView):
+    """
+    Enroll the student in ``course_ids`` (or the single legacy
+    ``course_id``). The courses are checked in one query and all new
+    enrollments written with one INSERT; the response reports the outcome
+    per course: enrolled, already_enrolled, not_found or unpaid.
+    """
+
     permission_classes = [IsAuthenticated]
+    max_courses = 100
 
     def post(self, request, *args, **kwargs):
         user = request.user
@@ -210,26 +502,80 @@ class EnrollView(APIView):
             )
 
         student = user.student
-        course_id = request.data.get("course_id")
-
+        legacy = "course_ids" not in request.data
+        if legacy:
+            course_ids = [request.data.get("course_id")]
+        elif hasattr(request.data, "getlist"):
+            # Form data repeats the key for each id
+            course_ids = request.data.getlist("course_ids")
+        else:
+            course_ids = request.data.get("course_ids")
         try:
-            course = Course.objects.get(id=course_id)
-            if course.category == "PAID":
-                if not student.paid:
-                    return Response(
-                        {"unpaid": "Subscribe to a payment plan."},
-                        status=status.HTTP_403_FORBIDDEN,
-                    )
-        except Course.DoesNotExist:
+            if not isinstance(course_ids, list):
+                raise TypeError
+            course_ids = list(dict.fromkeys(int(course_id) for course_id in course_ids))
+        except (TypeError, ValueError):
+            course_ids = None
+        if not course_ids or len(course_ids) > self.max_courses:
+            if legacy:
+                return Response(
+                    {"detail": "Course not found."}, status=status.HTTP_404_NOT_FOUND
+                )
             return Response(
-                {"detail": "Course not found."}, status=status.HTTP_404_NOT_FOUND
+                {
+                    "detail": "course_ids must be a list of 1 to %d course ids."
+                    % self.max_courses
+                },
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
-        student.courses_enlisted.add(course)
-        student.save()
+        through = Student.courses_enlisted.through
+        courses = Course.objects.filter(pk__in=course_ids).annotate(
+            enrolled=Exists(
+                through.objects.filter(student_id=student.pk, course_id=OuterRef("pk"))
+            )
+        )
+        results = dict.fromkeys(course_ids, "not_found")
+        new_enrollments = []
+        for course_id, category, enrolled in courses.values_list(
+            "pk", "category", "enrolled"
+        ):
+            if enrolled:
+                results[course_id] = "already_enrolled"
+            elif category == "PAID" and not student.paid:
+                results[course_id] = "unpaid"
+            else:
+                results[course_id] = "enrolled"
+                new_enrollments.append(through(student_id=student.pk, course_id=course_id))
+
+        if new_enrollments:
+            through.objects.bulk_create(new_enrollments, ignore_conflicts=True)
+            # bulk_create doesn't send m2m_changed
+            invalidate_entitlements(user.pk)
+
+        if legacy:
+            outcome = results[course_ids[0]]
+            if outcome == "not_found":
+                return Response(
+                    {"detail": "Course not found."}, status=status.HTTP_404_NOT_FOUND
+                )
+            if outcome == "unpaid":
+                return Response(
+                    {"unpaid": "Subscribe to a payment plan."},
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+            return Response(
+                {"detail": "Successfully enrolled in course."}, status=status.HTTP_200_OK
+            )
 
         return Response(
-            {"detail": "Successfully enrolled in course."}, status=status.HTTP_200_OK
+            {
+                "results": [
+                    {"course_id": course_id, "status": outcome}
+                    for course_id, outcome in results.items()
+                ]
+            },
+            status=status.HTTP_200_OK,
         )
 
 
@@ -320,280 +666,118 @@ class SaveInvoiceView(APIView):
 
 
 class IPNCallbackView(APIView):
-    # permission_classes = [IsAuthenticated]
-    def post(self, request, *args, **kwargs):
-        np_secret_key = env("IPN_KEY")
-        np_x_signature = request.headers.get("x-nowpayments-sig", "")
+    """
+    NOWPayments IPN webhook. Once the signature checks out the payload is
+    stored in the IPNMessage inbox and the callback answered right away;
+    process_ipn_inbox applies it. A retried callback for a status already
+    in the inbox is dropped by the inbox's unique constraint.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
 
-        if not np_x_signature:
-            return Response(
-                {"detail": "Signature missing"}, status=status.HTTP_400_BAD_REQUEST
+    def dispatch(self, request, *args, **kwargs):
+        # Callbacks are small, don't read a large body at all
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            return JsonResponse(
+                {"detail": "Invalid Content-Length"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if content_length > ipn.MAX_BODY_SIZE:
+            logger.warning("Rejected IPN callback: body of %d bytes", content_length)
+            return JsonResponse(
+                {"detail": "Request body too large"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             )
 
-        message = request.data
+        # Verified on the raw body before DRF parses or authenticates anything
+        try:
+            self.payload, self.signed_body = ipn.verify(
+                request.body, request.META.get(ipn.SIGNATURE_HEADER, "")
+            )
+        except ipn.InvalidSignature as e:
+            logger.warning("Rejected IPN callback: %s", e)
+            return JsonResponse({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return super().dispatch(request, *args, **kwargs)
 
-        # Sort and stringify the request data
-        sorted_message = json.dumps(message, separators=(",", ":"), sort_keys=True)
-        digest = hmac.new(
-            str(np_secret_key).encode(), sorted_message.encode(), hashlib.sha512
-        )
-        signature = digest.hexdigest()
-
-        if signature == np_x_signature:
-            # Handle the verified IPN message here
-            try:
-                print("IPN received and verified:", request.data)
-                # Process the notification data
-                payment_status = message.get("payment_status")
-                payment_id = message.get("payment_id")
-                pay_amount = message.get("pay_amount")
-                pay_currency = message.get("pay_currency")
-                order_id = message.get("order_id")
-                price_amount = message.get("price_amount")
-                price_currency = message.get("price_currency")
-
-                # Example: Find the corresponding payment object
-                payment = Payment.objects.get(payment_id=payment_id)
-
-                if payment_status == "waiting":
-                    self.handle_waiting_status(
-                        payment, order_id, pay_amount, pay_currency
-                    )
-                elif payment_status == "confirming":
-                    self.handle_confirming_status(
-                        payment, order_id, pay_amount, pay_currency
-                    )
-                elif payment_status == "confirmed":
-                    self.handle_confirmed_status(
-                        payment, order_id, pay_amount, pay_currency
-                    )
-                elif payment_status == "sending":
-                    self.handle_sending_status(
-                        payment, order_id, pay_amount, pay_currency
-                    )
-                elif payment_status == "partially_paid":
-                    self.handle_partially_paid_status(
-                        payment, order_id, pay_amount, pay_currency
-                    )
-                elif payment_status == "finished":
-                    duration_months = int(
-                        order_id.split("_")[2]
-                    )  # Corrected order_id parsing
-                    self.handle_finished_status(
-                        payment, order_id, pay_amount, pay_currency, duration_months
-                    )
-                elif payment_status == "failed":
-                    self.handle_failed_status(
-                        payment, order_id, pay_amount, pay_currency
-                    )
-                elif payment_status == "refunded":
-                    self.handle_refunded_status(
-                        payment, order_id, pay_amount, pay_currency
-                    )
-                elif payment_status == "expired":
-                    self.handle_expired_status(
-                        payment, order_id, pay_amount, pay_currency
-                    )
-                else:
-                    return Response(
-                        {"detail": "Unhandled payment status"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
+    def post(self, request, *args, **kwargs):
+        payment_id = self.payload.get("payment_id")
+        payment_status = self.payload.get("payment_status")
+        if payment_id is None or payment_status is None:
+            return Response(
+                {"detail": "payment_id and payment_status are required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-                return Response(
-                    {"detail": "IPN received and processed"}, status=status.HTTP_200_OK
+        IPNMessage.objects.bulk_create(
+            [
+                IPNMessage(
+                    payment_id=str(payment_id),
+                    payment_status=str(payment_status),
+                    payload=self.signed_body.decode(),
                 )
+            ],
+            ignore_conflicts=True,
+        )
+        return Response({"detail": "IPN received"}, status=status.HTTP_200_OK)
 
-            except Payment.DoesNotExist:
-                return Response(
-                    {"detail": "Payment not found"}, status=status.HTTP_404_NOT_FOUND
-                )
-            except Exception as e:
-                return Response(
-                    {"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
 
-        else:
-            print("HMAC signature does not match")
+class PaymentEventListView(generics.ListAPIView):
+    """
+    History of the IPN callbacks received for a payment, oldest first and
+    keyset paginated, read from the append-only PaymentEvent log.
+    """
+
+    permission_classes = [IsAdminUser]
+    serializer_class = PaymentEventSerializer
+    keyset_ordering = ("received_at", "id")
+
+    def get_queryset(self):
+        return PaymentEvent.objects.filter(payment_id=self.kwargs["payment_id"])
+
+
+class RevenueReportView(APIView):
+    """
+    Revenue per day, week or month (``?bucket=``), currency and
+    subscription type between ``start`` and ``end`` (ISO dates, the last 30
+    days by default), served from the precomputed RevenueRollup rows.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        bucket = request.query_params.get("bucket", "day")
+        if bucket not in reports.BUCKETS:
             return Response(
-                {"detail": "Invalid signature"}, status=status.HTTP_400_BAD_REQUEST
+                {"detail": "bucket must be one of: %s." % ", ".join(reports.BUCKETS)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            end = date.fromisoformat(
+                request.query_params.get("end") or timezone.localdate().isoformat()
+            )
+            start = date.fromisoformat(
+                request.query_params.get("start")
+                or (end - timedelta(days=30)).isoformat()
+            )
+        except ValueError:
+            return Response(
+                {"detail": "start and end must be dates (YYYY-MM-DD)."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
-    # def handle_finished_status(self, payment, duration_months):
-    #     student = payment.student
-    #     if student.paid:
-    #         student.extend_subscription(duration_months)
-    #     else:
-    #         student.subscribe(duration_months)
-    #     student.save()
-    #     print(
-    #         f"Subscription updated for student ID: {student.id} based on payment ID: {payment.payment_id}"
-    #     )
-
-    def handle_waiting_status(self, payment_id, order_id, pay_amount, pay_currency):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "waiting",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
-        )
-        if not created:
-            payment.status = "waiting"
-            payment.save()
-        print(f"Payment {payment_id} is waiting. Order ID: {order_id}")
-
-    def handle_confirming_status(self, payment_id, order_id, pay_amount, pay_currency):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "confirming",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
-        )
-        if not created:
-            payment.status = "confirming"
-            payment.save()
-        print(f"Payment {payment_id} is confirming. Order ID: {order_id}")
-        # Send confirmation email
-        # send_confirmation_email(order_id)
-
-    def handle_confirmed_status(self, payment_id, order_id, pay_amount, pay_currency):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "confirmed",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
-        )
-        if not created:
-            payment.status = "confirmed"
-            payment.save()
-        print(f"Payment {payment_id} is confirmed. Order ID: {order_id}")
-        # Send confirmation email
-        # send_confirmation_email(order_id)
-
-    def handle_sending_status(self, payment_id, order_id, pay_amount, pay_currency):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "sending",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
-        )
-        if not created:
-            payment.status = "sending"
-            payment.save()
-        print(f"Payment {payment_id} is sending. Order ID: {order_id}")
-        # Send confirmation email
-        # send_confirmation_email(order_id)
-
-    def handle_partially_paid_status(
-        self, payment_id, order_id, pay_amount, pay_currency
-    ):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "partially_paid",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
+        results = reports.revenue_report(
+            bucket,
+            start,
+            end,
+            currency=request.query_params.get("currency"),
+            subscription_type=request.query_params.get("subscription_type"),
         )
-        if not created:
-            payment.status = "partially_paid"
-            payment.save()
-        print(f"Payment {payment_id} is partially_paid. Order ID: {order_id}")
-        # Send confirmation email
-        # send_confirmation_email(order_id)
-
-    def handle_finished_status(
-        self, payment_id, order_id, pay_amount, pay_currency, duration_months
-    ):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "finished",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
-        )
-        if not created:
-            payment.status = "finished"
-            payment.save()
-        # Update Student subscription status
-        student = payment.student
-        if student.paid:
-            student.extend_subscription(duration_months)
-        else:
-            student.subscribe(duration_months)
-        student.save()
-        print(
-            f"Subscription updated for student ID: {student.id} based on payment ID: {payment.payment_id}"
-        )
-        print(f"Payment {payment_id} is finished. Order ID: {order_id}")
-        # Grant access to the service or product
-        # grant_access(order_id)
-
-    def handle_failed_status(self, payment_id, order_id, pay_amount, pay_currency):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "failed",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
-        )
-        if not created:
-            payment.status = "failed"
-            payment.save()
-        print(f"Payment {payment_id} failed. Order ID: {order_id}")
-        # Notify the user about the failure
-        # notify_failure(order_id)
-
-    def handle_refunded_status(self, payment_id, order_id, pay_amount, pay_currency):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "refunded",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
-        )
-        if not created:
-            payment.status = "refunded"
-            payment.save()
-        print(f"Payment {payment_id} refunded. Order ID: {order_id}")
-        # Notify the user about the failure
-        # notify_failure(order_id)
-
-    def handle_expired_status(self, payment_id, order_id, pay_amount, pay_currency):
-        payment, created = Payment.objects.get_or_create(
-            payment_id=payment_id,
-            defaults={
-                "order_id": order_id,
-                "status": "expired",
-                "pay_amount": pay_amount,
-                "pay_currency": pay_currency,
-            },
+        return Response(
+            {"bucket": bucket, "start": start, "end": end, "results": results}
         )
-        if not created:
-            payment.status = "expired"
-            payment.save()
-        print(f"Payment {payment_id} expired. Order ID: {order_id}")
-        # Notify the user about the failure
-        # notify_failure(order_id)
 
 
 class ContactMessageView(APIView):
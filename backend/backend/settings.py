@@ -72,8 +72,10 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         # 'api.authenticate.CustomAuthentication', 
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'api.authenticate.CachedUserJWTAuthentication',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
 }
 
 MIDDLEWARE = [
@@ -132,6 +134,48 @@ DATABASES = {
 # DATABASES["default"] = dj_database_url.parse(database_url)
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Use a shared backend (e.g. CACHE_URL=rediscache://...) when running several workers
+
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+
+# Lifetime (seconds) of cached catalog responses, see api.cache
+CATALOG_CACHE_TIMEOUT = env.int("CATALOG_CACHE_TIMEOUT", default=60 * 5)
+
+# Oldest (seconds) the per-process autocomplete index gets without a shared
+# cache, see api.autocomplete
+AUTOCOMPLETE_INDEX_MAX_AGE = env.int("AUTOCOMPLETE_INDEX_MAX_AGE", default=60)
+
+# Lifetime (seconds) of cached student entitlements, see api.entitlements
+ENTITLEMENTS_CACHE_TIMEOUT = env.int("ENTITLEMENTS_CACHE_TIMEOUT", default=60 * 60)
+
+# Sign student entitlements into access tokens and trust them for access checks
+JWT_ENTITLEMENT_CLAIMS = env.bool("JWT_ENTITLEMENT_CLAIMS", default=False)
+
+# Cached users for JWT authentication, see api.usercache: lifetime (seconds)
+# in the shared cache, and size and lifetime of the per-process LRU
+AUTH_USER_CACHE_TIMEOUT = env.int("AUTH_USER_CACHE_TIMEOUT", default=60 * 5)
+AUTH_USER_LOCAL_CACHE_SIZE = env.int("AUTH_USER_LOCAL_CACHE_SIZE", default=1024)
+AUTH_USER_LOCAL_CACHE_TTL = env.int("AUTH_USER_LOCAL_CACHE_TTL", default=30)
+
+# Bloom filter of blacklisted refresh tokens, see api.blacklist: expected
+# number of live blacklisted tokens (rebuilds size the filter for twice the
+# live rows when there are more), target false positive rate, and how
+# often (seconds) a process pulls rows blacklisted elsewhere regardless of
+# the shared generation counter
+# The filter is only used with a shared cache backend (CACHE_URL), with the
+# default per-process one every check queries the database
+TOKEN_BLACKLIST_BLOOM_CAPACITY = env.int("TOKEN_BLACKLIST_BLOOM_CAPACITY", default=100_000)
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = env.float("TOKEN_BLACKLIST_BLOOM_ERROR_RATE", default=0.01)
+TOKEN_BLACKLIST_SYNC_INTERVAL = env.int("TOKEN_BLACKLIST_SYNC_INTERVAL", default=30)
+
+# NOWPayments IPN secret, see api.ipn
+IPN_KEY = env("IPN_KEY", default="")
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -174,6 +218,7 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
     'TOKEN_USER_CLASS': 'rest_framework_simplejwt.models.TokenUser',
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.MyTokenRefreshSerializer',
 
     'JTI_CLAIM': 'jti',
 
@@ -218,6 +263,16 @@ if not DEBUG:
 MEDIA_URL ="/media/"
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Content-addressed store for course images (see api.storage)
+COURSE_IMAGE_ROOT = MEDIA_ROOT / "course_images"
+
+# Cache lifetime (seconds) of /api/course/<id>/image/ responses
+COURSE_IMAGE_MAX_AGE = env.int("COURSE_IMAGE_MAX_AGE", default=60 * 60 * 24)
+
+# Disk cache of resized/re-encoded course images (see api.variants)
+IMAGE_VARIANT_CACHE_DIR = env("IMAGE_VARIANT_CACHE_DIR", default=str(BASE_DIR / "cache" / "image_variants"))
+IMAGE_VARIANT_CACHE_MAX_BYTES = env.int("IMAGE_VARIANT_CACHE_MAX_BYTES", default=256 * 1024 * 1024)
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field